@@ -0,0 +1,88 @@
+"""
+Content-addressed store for uploaded images.
+
+Each image is saved as <root>/<first 2 hex digits>/<sha256 of its contents>.<extension>, so uploading the same image
+twice stores it once, and a file's name never changes while its contents stay the same. That lets the app serve
+images with "immutable" cache headers, and lets a card keep an uploaded image's URL without checking it again on
+every save.
+
+Uploads are copied to disk in chunks while being hashed, so a large image is never held in memory all at once.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+
+# The first bytes of each image format we accept, since browsers' content-type headers can't be trusted
+image_signatures = {
+    b"\x89PNG\r\n\x1a\n": "png",
+    b"\xff\xd8\xff": "jpg",
+    b"GIF87a": "gif",
+    b"GIF89a": "gif",
+}
+blob_name_pattern = re.compile(r"[0-9a-f]{64}\.(png|jpg|gif)")
+
+
+class NotAnImageError(ValueError):
+    pass
+
+
+class TooLargeError(ValueError):
+    pass
+
+
+class BlobStore:
+    def __init__(self, root: str, chunk_size: int, max_bytes: int):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+
+    def save(self, stream) -> str:
+        """Copies an image from a file-like object into the store and returns its name, e.g. '3fa9...c2.png'"""
+        temp_dir = os.path.join(self.root, "tmp")  # on the same filesystem as the store, so the final move is atomic
+        os.makedirs(temp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        extension = None
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    if extension is None:
+                        extension = image_extension(chunk)
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise TooLargeError(f"Image is larger than {self.max_bytes // 1024 // 1024} MB")
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+            if extension is None:
+                raise NotAnImageError("Uploaded file is empty")
+            name = f"{digest.hexdigest()}.{extension}"
+            path = self.path(name)
+            if os.path.exists(path):
+                os.remove(temp_path)  # already have this image
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+            return name
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def path(self, name: str) -> str:
+        """Where the blob with this name is (or would be) stored. Raises ValueError for names we didn't make"""
+        if not blob_name_pattern.fullmatch(name):
+            raise ValueError(f"Not a blob name: {name}")
+        return os.path.join(self.root, name[:2], name)
+
+
+def image_extension(first_chunk: bytes) -> str:
+    for signature, extension in image_signatures.items():
+        if first_chunk.startswith(signature):
+            return extension
+    raise NotAnImageError("Uploaded file is not a PNG, JPEG or GIF image")
@@ -0,0 +1,96 @@
+"""
+Circuit breaker for calls to the database.
+
+While the breaker is closed, calls go through as normal and their outcomes are recorded. If too many of the recent
+calls failed, the breaker opens: calls fail straight away instead of each waiting for a timeout, and a background
+thread probes the database every few seconds. When a probe succeeds, recover runs (used to replay writes queued
+while the database was down) and then the breaker closes. If recover raises, the breaker stays open and probing
+carries on. recover may also close the breaker itself, with close(), e.g. while holding a lock of its own. open() opens
+the breaker straight away, for callers that have left work for recover to do.
+"""
+
+import threading
+import time
+from collections import deque
+from loguru import logger
+
+CLOSED = "closed"
+OPEN = "open"
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float,
+        window_size: int,
+        min_calls: int,
+        probe_interval: float,
+        probe=None,
+        recover=None,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate  # open when at least this fraction of the last window_size calls failed...
+        self.min_calls = min_calls  # ...and there have been at least this many
+        self.outcomes = deque(maxlen=window_size)  # True for success
+        self.probe_interval = probe_interval
+        self.probe = probe  # function that raises if the database is still unreachable
+        self.recover = recover
+        self.state = CLOSED
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == OPEN
+
+    def record_success(self):
+        with self.lock:
+            self.outcomes.append(True)
+
+    def record_failure(self):
+        with self.lock:
+            self.outcomes.append(False)
+            if self.state == OPEN or len(self.outcomes) < self.min_calls:
+                return
+            failures = self.outcomes.count(False)
+            if failures / len(self.outcomes) < self.failure_rate:
+                return
+            self.state = OPEN
+            self.opened_at = time.time()
+        logger.error(f"Circuit breaker {self.name} opened: {failures} of the last {len(self.outcomes)} calls failed")
+        self._start_probing()
+
+    def open(self, reason: str):
+        """Opens the breaker whatever the recent outcomes, e.g. because there's work waiting that only recover does"""
+        with self.lock:
+            if self.state == OPEN:
+                return
+            self.state = OPEN
+            self.opened_at = time.time()
+        logger.error(f"Circuit breaker {self.name} opened: {reason}")
+        self._start_probing()
+
+    def _start_probing(self):
+        threading.Thread(target=self._probe_until_closed, name=f"{self.name}-probe", daemon=True).start()
+
+    def close(self):
+        with self.lock:
+            if self.state == CLOSED:
+                return
+            self.state = CLOSED
+            self.outcomes.clear()
+        logger.info(f"Circuit breaker {self.name} closed after {time.time() - self.opened_at:.0f} s")
+
+    def _probe_until_closed(self):
+        while True:
+            time.sleep(self.probe_interval)
+            try:
+                self.probe()
+                if self.recover:
+                    self.recover()
+            except Exception as e:
+                logger.warning(f"Circuit breaker {self.name} still open: {e!r}")
+                continue
+            break
+        self.close()
@@ -0,0 +1,174 @@
+"""
+Near-duplicate detection for cards, using MinHash and locality sensitive hashing (LSH).
+
+Each card's title and body are split into word pairs (shingles). Two cards are near-duplicates when they share most of
+their shingles, i.e. the Jaccard similarity of their shingle sets is high. Comparing a new card with every card in the
+deck would take O(n) per card, so instead:
+ * each card gets a MinHash signature: NUM_PERMUTATIONS numbers such that the fraction of positions where two
+   signatures agree estimates the Jaccard similarity of the two cards
+ * signatures are cut into LSH_BANDS bands, and every band is hashed into a bucket. Cards that share a bucket for
+   any band are candidates, and only candidates are compared.
+Looking up a card therefore costs one signature and LSH_BANDS dict lookups, whatever the size of the deck. With 16
+bands of 4 rows, cards with a similarity of 0.7 become candidates about 99% of the time, and cards with a similarity
+of 0.2 less than 3% of the time.
+"""
+
+import random
+import threading
+import zlib
+from collections import defaultdict, namedtuple
+from loguru import logger
+from search_index import tokenize
+
+Duplicate = namedtuple("Duplicate", ["card_id", "title", "similarity"])
+
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+SHINGLE_SIZE = 2  # words per shingle
+MERSENNE_PRIME = (1 << 61) - 1
+BIN_RANGE = MERSENNE_PRIME // NUM_PERMUTATIONS + 1  # hash values per bin
+
+# The same "random" hash every run, so signatures are comparable between processes
+_random = random.Random(1)
+HASH_A = _random.randrange(1, MERSENNE_PRIME)
+HASH_B = _random.randrange(0, MERSENNE_PRIME)
+
+
+def shingles(title: str, body: str) -> set:
+    """The set of hashed word pairs in a card's title and body"""
+    words = tokenize(title) + tokenize(body)
+    if len(words) < SHINGLE_SIZE:
+        return {zlib.crc32(word.encode()) for word in words}
+    return {
+        zlib.crc32(" ".join(words[i: i + SHINGLE_SIZE]).encode()) for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def signature(shingle_hashes: set) -> tuple:
+    """
+    MinHash signature of a set of shingle hashes, or None for an empty set.
+
+    Uses one permutation hashing: each shingle is hashed once and lands in one of NUM_PERMUTATIONS bins, and each
+    position of the signature is the smallest hash in its bin. This costs O(shingles) instead of the
+    O(shingles * NUM_PERMUTATIONS) of classic MinHash, which matters in pure Python. Empty bins (short cards) borrow
+    the value of the next non-empty bin, offset by the distance to it, so they still only match on similar cards.
+    """
+    if not shingle_hashes:
+        return None
+    bins = [None] * NUM_PERMUTATIONS
+    for shingle in shingle_hashes:
+        bin_number, value = divmod((HASH_A * shingle + HASH_B) % MERSENNE_PRIME, BIN_RANGE)
+        if bins[bin_number] is None or value < bins[bin_number]:
+            bins[bin_number] = value
+    # Walk backwards twice round the circle so every empty bin sees the nearest non-empty bin to its right
+    next_value, distance = None, 0
+    for i in reversed(range(2 * NUM_PERMUTATIONS)):
+        bin_value = bins[i % NUM_PERMUTATIONS]
+        if i >= NUM_PERMUTATIONS:
+            if bin_value is not None:
+                next_value, distance = bin_value, 0
+            distance += 1
+            continue
+        if bin_value is None:
+            bins[i] = next_value + distance * BIN_RANGE
+        else:
+            next_value, distance = bin_value, 0
+        distance += 1
+    return tuple(bins)
+
+
+def bands(card_signature: tuple) -> list:
+    """The LSH bucket keys of a signature, one per band"""
+    return [(band, card_signature[band * LSH_ROWS: (band + 1) * LSH_ROWS]) for band in range(LSH_BANDS)]
+
+
+def similarity(signature_1: tuple, signature_2: tuple) -> float:
+    """Estimated Jaccard similarity of the cards with these signatures"""
+    return sum(1 for x, y in zip(signature_1, signature_2) if x == y) / NUM_PERMUTATIONS
+
+
+class DuplicateIndex:
+    """LSH index of card signatures. Cards are identified by card_id, not the Airtable rec_id"""
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold  # estimated similarity at or above which a card counts as a duplicate
+        self.buckets = defaultdict(set)  # (band number, band of signature) -> {card_id}
+        self.signatures = {}  # card_id -> signature
+        self.fingerprints = {}  # card_id -> crc of title and body, so unchanged cards aren't re-hashed
+        self.titles = {}
+        self.is_built = False
+        self.lock = threading.Lock()
+
+    def build(self, cards: list):
+        """(Re)builds the whole index from a list of card dicts (as returned by add_missing())"""
+        with self.lock:
+            self.buckets.clear()
+            self.signatures.clear()
+            self.fingerprints.clear()
+            self.titles.clear()
+            for card in cards:
+                if not card["archived"]:
+                    self._add(card)
+            self.is_built = True
+        logger.info(f"Duplicate index built: {len(self.signatures)} cards, {len(self.buckets)} buckets")
+
+    def update_card(self, card: dict):
+        """Adds a new card or re-indexes an edited one. Archived cards are removed from the index"""
+        with self.lock:
+            card_id = card["card_id"]
+            if card.get("archived"):
+                self._remove(card_id)
+            elif self.fingerprints.get(card_id) != fingerprint(card):
+                self._remove(card_id)
+                self._add(card)
+            else:
+                self.titles[card_id] = card.get("title")
+
+    def remove_card(self, card_id: int):
+        with self.lock:
+            self._remove(card_id)
+
+    def find_duplicates(self, title: str, body: str, exclude_card_id: int = None) -> list:
+        """Returns Duplicates of a card with this title and body, most similar first"""
+        card_signature = signature(shingles(title, body))
+        if card_signature is None:
+            return []
+        with self.lock:
+            candidates = set()
+            for key in bands(card_signature):
+                candidates.update(self.buckets.get(key, ()))
+            candidates.discard(exclude_card_id)
+            duplicates = []
+            for card_id in candidates:
+                card_similarity = similarity(card_signature, self.signatures[card_id])
+                if card_similarity >= self.threshold:
+                    duplicates.append(Duplicate(card_id, self.titles[card_id], card_similarity))
+        return sorted(duplicates, key=lambda duplicate: duplicate.similarity, reverse=True)
+
+    def _add(self, card: dict):
+        card_id = card["card_id"]
+        card_signature = signature(shingles(card.get("title"), card.get("body")))
+        self.fingerprints[card_id] = fingerprint(card)
+        self.titles[card_id] = card.get("title")
+        if card_signature is None:
+            return  # nothing to compare
+        self.signatures[card_id] = card_signature
+        for key in bands(card_signature):
+            self.buckets[key].add(card_id)
+
+    def _remove(self, card_id: int):
+        self.fingerprints.pop(card_id, None)
+        self.titles.pop(card_id, None)
+        card_signature = self.signatures.pop(card_id, None)
+        if card_signature is None:
+            return
+        for key in bands(card_signature):
+            bucket = self.buckets[key]
+            bucket.discard(card_id)
+            if not bucket:
+                del self.buckets[key]
+
+
+def fingerprint(card: dict) -> int:
+    return zlib.crc32(f"{card.get('title')}\x00{card.get('body')}".encode())
@@ -1,6 +1,8 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField, IntegerField, PasswordField, HiddenField, DateField
-from wtforms.validators import DataRequired, URL, NumberRange
+from flask_wtf.file import FileField, FileAllowed
+from wtforms import StringField, SubmitField, IntegerField, PasswordField, HiddenField, DateField, SelectField, \
+    FloatField, BooleanField
+from wtforms.validators import DataRequired, URL, NumberRange, Optional
 from flask_ckeditor import CKEditorField
 import global_constants as gc
 
@@ -10,6 +12,8 @@ import global_constants as gc
 class CreateCardForm(FlaskForm):
     title = StringField("Title", validators=[DataRequired()])
     img_url = StringField("Image URL (optional)")
+    img_upload = FileField("Or upload an image (optional)",
+                           validators=[FileAllowed(["png", "jpg", "jpeg", "gif"], "Image must be a PNG, JPEG or GIF")])
     num_views = IntegerField("Number of Views")
     initial_frequency = IntegerField(f"Initial Frequency (1 = v. low, {gc.INITIAL_FREQUENCY_MAX} = very high, "
                                      f"default={gc.INITIAL_FREQUENCY_DEFAULT})",
@@ -48,3 +52,30 @@ class LoginForm(FlaskForm):
     email = StringField("Email", validators=[DataRequired()])
     password = PasswordField("Password", validators=[DataRequired()])
     submit = SubmitField('Log me in')
+
+
+class ProfilerForm(FlaskForm):
+    mode = SelectField("Profiler", choices=[("cprofile", "cProfile (download as .pstats)"),
+                                            ("sample", "Stack sampler (download as collapsed stacks for flame graphs)")])
+    endpoints = StringField("Profile these routes (view function names separated by spaces, e.g. show_card)")
+    user_ids = StringField("Profile these users (user ids separated by spaces)")
+    sample_rate = FloatField("Also profile this fraction of all other requests (0 to 1)",
+                             validators=[Optional(), NumberRange(min=0, max=1,
+                                                                 message='Fraction must be between 0 and 1')])
+    allow_header = BooleanField("Profile my requests sent with the X-Profile header")
+    submit = SubmitField("Save")
+
+
+class BulkEditForm(FlaskForm):
+    select_by = SelectField("Select cards by", choices=[("tag", "Tag"), ("card_ids", "Card numbers")])
+    selection = StringField("Tag, or card numbers separated by spaces", validators=[DataRequired()])
+    operation = SelectField("Change", choices=[("archive", "Archive"),
+                                               ("unarchive", "Unarchive"),
+                                               ("add_tags", "Add tags"),
+                                               ("remove_tags", "Remove tags"),
+                                               ("set_tags", "Replace all tags"),
+                                               ("set_frequency", "Set initial frequency"),
+                                               ("set_decay", "Set frequency decay"),
+                                               ("reset_views", "Reset number of views to 0")])
+    value = StringField("Tags (separated by spaces), initial frequency or frequency decay, if needed")
+    submit = SubmitField("Apply to all selected cards")
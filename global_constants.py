@@ -7,4 +7,31 @@ FREQUENCY_DECAY_RATE_MAX = 10
 SKIP_UNTIL_DATE_DEFAULT = "2023-01-01"
 BROKEN_LINK_IMG_URL = 'https://media.istockphoto.com/vectors/broken-chain-link-icon-vector-concept-demage-connecti' \
                       'on-or-join-in-vector-id1165216254?k=6&m=1165216254&s=170667a&w=0&h=-jie62m9pcNwUA3V0mYzvCCt' \
-                      'QvZoj8T7dDWDZ7gHDaQ='
\ No newline at end of file
+                      'QvZoj8T7dDWDZ7gHDaQ='
+SEARCH_RESULTS_MAX = 25  # max number of cards listed on the /search page
+IO_POOL_WORKERS = 16  # threads (and pooled db connections) for running independent Airtable calls concurrently
+REVIEW_LOG_FILE = "review_log.bin"  # append-only log of card views and skips, in APP_DATA_DIR (default: the app folder)
+REVIEW_COUNTS_FILE = "review_counts.json"  # per-user, per-card counts that the review log is compacted into
+REVIEW_LOG_COMPACT_EVENTS = 50  # compact the review log (and update num_views in db) after this many events...
+REVIEW_LOG_COMPACT_SECONDS = 600  # ...or this many seconds after the last compaction
+FORMULA_MAX_CARDS = 50  # max card_ids in one filterByFormula, to keep request URLs short
+PROFILER_MAX_PROFILES = 50  # request profiles kept in memory for admins to download (when PROFILER_ENABLED is set)
+PROFILER_SAMPLE_INTERVAL_MS = 5  # how often the stack sampler looks at a profiled request
+AIRTABLE_REQUESTS_PER_SECOND = 5  # Airtable's rate limit per base
+IMPORT_TIME_BUDGET_MS = 400  # max time for a fresh process to import (and set up) main.py, see loadtest/startup_time.py
+IMAGE_STORE_DIR = "uploads"  # uploaded images, stored by content hash, in APP_DATA_DIR
+IMAGE_UPLOAD_MAX_BYTES = 10 * 1024 * 1024
+IMAGE_UPLOAD_CHUNK_BYTES = 64 * 1024  # uploads are copied to disk this much at a time
+IMAGE_CACHE_SECONDS = 365 * 24 * 60 * 60
+AIRTABLE_TIMEOUT = (3.05, 10)  # seconds to connect, seconds to wait for a response
+STORAGE_BREAKER_FAILURE_RATE = 0.5  # stop calling the db when this fraction of recent calls failed...
+STORAGE_BREAKER_WINDOW = 20  # ...out of the last this many calls...
+STORAGE_BREAKER_MIN_CALLS = 4  # ...and at least this many calls were made
+STORAGE_BREAKER_PROBE_SECONDS = 10  # while the db is down, check if it's back this often
+STALE_CACHE_MAX_ENTRIES = 2000  # db reads kept to serve while the db is down
+DUPLICATE_SIMILARITY = 0.6  # flag a new or edited card when about this fraction of its word pairs match another card
+DUPLICATES_LISTED_MAX = 3  # max similar cards named in the duplicate warning
+STATS_REBUILD_SECONDS = 60 * 60  # recount the /stats totals from the db this often, to pick up other processes' changes
+STATS_WEIGHT_BUCKET = 1  # width of the bars in the /stats weight histogram
+STATS_COMING_DUE_DATES = 7  # max dates listed under "coming due" on /stats
+REVIEW_LOG_PUSH_TIMEOUT = 5 * 60  # a push of views to the db not finished after this long is assumed dead and redone
@@ -0,0 +1,14 @@
+# Gunicorn settings, picked up automatically when running: gunicorn
+# Requests spend nearly all their time waiting on Airtable, so each worker runs several threads and one worker
+# can serve many users at once. Each worker process has its own Schedule, so keep the number of workers small.
+import os
+
+wsgi_app = "wsgi:app"
+bind = os.environ.get("BIND", "127.0.0.1:5001")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_class = "gthread"
+threads = int(os.environ.get("WORKER_THREADS", 16))
+timeout = 60
+# Import the app once in the master and fork workers from it, so starting a worker costs almost nothing. This is safe
+# because nothing opens connections or starts threads at import: see storage.py and create_app() in main.py.
+preload_app = True
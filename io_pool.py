@@ -0,0 +1,111 @@
+"""
+Runs independent Airtable calls concurrently.
+
+Flask 1.1 has no async views, so instead of an event loop we fan blocking calls out to a shared thread pool and wait
+for all of them. Each call still blocks a pool thread, but the request only waits as long as the slowest call instead
+of the sum of all of them. The Airtable tables share one requests Session (see share_session()) so the pool threads
+reuse keep-alive connections rather than opening a new TLS connection per call.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from flask import has_request_context, copy_current_request_context
+from requests.adapters import HTTPAdapter
+import global_constants as gc
+
+POOL_THREAD_PREFIX = "airtable-io"
+executor = ThreadPoolExecutor(max_workers=gc.IO_POOL_WORKERS, thread_name_prefix=POOL_THREAD_PREFIX)
+
+
+class RateLimiter:
+    """Spaces out calls so there are never more than rate per second, however many threads are making them"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start_time = max(now, self.next_time)
+            self.next_time = start_time + self.interval
+        time.sleep(start_time - now)
+
+
+airtable_rate_limiter = RateLimiter(gc.AIRTABLE_REQUESTS_PER_SECOND)
+
+
+def run_concurrently(*calls):
+    """Runs each zero-argument callable in the pool and returns their results in the same order.
+    Calls made during a request keep its context, so flash() and current_user work inside them.
+    If any call raises, the exception is re-raised here once every call has finished."""
+    outcomes = wait_for_all(calls)
+    for result, error in outcomes:
+        if error is not None:
+            raise error
+    return [result for result, error in outcomes]
+
+
+def wait_for_all(calls) -> list:
+    """Runs zero-argument callables in the pool and returns a (result, exception or None) per call, in order.
+    On a pool thread the calls run one after another instead: a pool task that waited for other pool tasks could
+    wait forever once every pool thread was doing the same."""
+    if on_pool_thread():
+        outcomes = []
+        for call in calls:
+            try:
+                outcomes.append((call(), None))
+            except Exception as e:
+                outcomes.append((None, e))
+        return outcomes
+    futures = [submit(call) for call in calls]
+    return [(None, future.exception()) if future.exception() else (future.result(), None) for future in futures]
+
+
+def on_pool_thread() -> bool:
+    return threading.current_thread().name.startswith(POOL_THREAD_PREFIX)
+
+
+def submit(call):
+    """Starts a zero-argument callable in the pool and returns its Future, keeping the request context like
+    run_concurrently()"""
+    if has_request_context():
+        call = copy_current_request_context(call)
+    return executor.submit(call)
+
+
+def share_session(*tables):
+    """Makes all tables use the first table's Session, with a connection pool big enough for every pool thread"""
+    session = tables[0].session
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=gc.IO_POOL_WORKERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    for table in tables[1:]:
+        table.session = session
+    return session
+
+
+def batch_update_concurrently(table, updates_list: list) -> tuple:
+    """Like table.batch_update(), but sends the chunks of 10 records in parallel rather than one after another,
+    as fast as Airtable's rate limit allows.
+    Returns the updated records, the updates that failed and the first error raised (or None). Unlike
+    run_concurrently(), a failed chunk doesn't hide the records the other chunks did update."""
+    def update_chunk(chunk):
+        airtable_rate_limiter.wait()
+        return table.batch_update(chunk)
+
+    chunk_size = table.MAX_RECORDS_PER_REQUEST
+    chunks = [updates_list[i: i + chunk_size] for i in range(0, len(updates_list), chunk_size)]
+    outcomes = wait_for_all([partial(update_chunk, chunk) for chunk in chunks])
+    updated_records, failed_updates, first_error = [], [], None
+    for chunk, (chunk_records, error) in zip(chunks, outcomes):
+        if error is not None:
+            failed_updates.extend(chunk)
+            first_error = first_error or error
+        elif chunk_records:
+            updated_records.extend(chunk_records)
+            # ^ chunk_records is None for chunks queued while the db is down (see storage.py)
+    return updated_records, failed_updates, first_error
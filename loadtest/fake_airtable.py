@@ -0,0 +1,286 @@
+"""
+A local stand-in for the parts of the Airtable REST API that Phlashcards uses, for load testing without touching
+(or being rate limited by) the real database.
+
+Supports listing records (filterByFormula, fields[], maxRecords, pageSize, offset), creating, updating and batch
+updating records. Formulas can be anything pyairtable's match(), AND(), OR() and EQUAL() produce. Every request can
+be delayed by a configurable latency, and answered with a 429 "too many requests" either at random or when the
+per-base rate limit (5 requests/second on real Airtable) is exceeded.
+
+Run it on its own:
+    python -m loadtest.fake_airtable --port 8090 --cards 500 --latency-ms 150
+then start the app with AIRTABLE_API_URL=http://127.0.0.1:8090/v0 so pyairtable talks to it.
+"""
+
+import argparse
+import datetime as dt
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+# Autonumber field for each table, like the ones set up in the real base
+autonumber_fields = {"cards_table": "card_id", "users_table": "user_id"}
+sample_tags = ["Spanish", "History", "Names", "Science", "Poems", "Language"]
+
+
+class FakeAirtable:
+    """The tables and the latency/rate limit settings. Shared by all request handler threads."""
+
+    def __init__(self, latency_ms=0.0, latency_jitter_ms=0.0, error_rate=0.0, requests_per_second=0.0):
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate  # chance of answering any request with a 429
+        self.requests_per_second = requests_per_second  # 0 means no limit
+        self.tables = {}  # table name -> {rec_id: record}
+        self.next_autonumber = {}
+        self.lock = threading.Lock()
+        self.request_times = []  # for the rate limit
+
+    def table(self, name: str) -> dict:
+        return self.tables.setdefault(name, {})
+
+    def seed_cards(self, num_cards: int):
+        for i in range(num_cards):
+            self.create(
+                "cards_table",
+                {
+                    "title": f"Card {i + 1}",
+                    "body": f"<p>Body of card {i + 1}. " + "Lorem ipsum dolor sit amet. " * random.randint(5, 40) + "</p>",
+                    "author": "loadtest",
+                    "num_views": random.randint(0, 30),
+                    "initial_frequency": random.randint(1, 10),
+                    "frequency_decay": random.randint(1, 10),
+                    "tags": " ".join(random.sample(sample_tags, random.randint(1, 2))),
+                    "skip_until": "2023-01-01",
+                },
+            )
+
+    def create(self, table_name: str, fields: dict) -> dict:
+        with self.lock:
+            table = self.table(table_name)
+            fields = {k: v for k, v in fields.items() if v not in (None, "", False)}  # Airtable drops empty fields
+            autonumber_field = autonumber_fields.get(table_name)
+            if autonumber_field:
+                self.next_autonumber[table_name] = self.next_autonumber.get(table_name, 0) + 1
+                fields[autonumber_field] = self.next_autonumber[table_name]
+            fields.setdefault("date_created", dt.date.today().isoformat())
+            rec_id = "rec" + "".join(random.choices("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789", k=14))
+            record = {"id": rec_id, "createdTime": dt.datetime.utcnow().isoformat() + "Z", "fields": fields}
+            table[rec_id] = record
+            return record
+
+    def update(self, table_name: str, rec_id: str, fields: dict) -> dict:
+        with self.lock:
+            record = self.table(table_name)[rec_id]
+            for key, value in fields.items():
+                if value in (None, "", False):
+                    record["fields"].pop(key, None)
+                else:
+                    record["fields"][key] = value
+            return record
+
+    def select(self, table_name: str, formula: str = None) -> list:
+        with self.lock:
+            records = list(self.table(table_name).values())
+        if formula:
+            test = parse_formula(formula)
+            records = [record for record in records if test(record["fields"])]
+        return records
+
+    def throttle(self) -> bool:
+        """Waits for the configured latency. Returns True if this request should get a 429"""
+        delay = self.latency_ms + random.uniform(-self.latency_jitter_ms, self.latency_jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if self.error_rate and random.random() < self.error_rate:
+            return True
+        if self.requests_per_second:
+            with self.lock:
+                now = time.monotonic()
+                self.request_times = [t for t in self.request_times if now - t < 1]
+                if len(self.request_times) >= self.requests_per_second:
+                    return True
+                self.request_times.append(now)
+        return False
+
+
+# FORMULAS
+# Just enough of Airtable's formula language for what pyairtable.formulas builds: {field}=value, AND(...), OR(...)
+value_pattern = re.compile(r"'((?:[^'\\]|\\.)*)'|\"((?:[^\"\\]|\\.)*)\"|(-?\d+(?:\.\d+)?)|(TRUE\(\)|FALSE\(\))")
+
+
+def parse_formula(formula: str):
+    """Returns a function of a record's fields that is True if the record matches the formula"""
+    formula = formula.strip()
+    for function_name, combine in (("AND(", all), ("OR(", any)):
+        if formula.startswith(function_name) and formula.endswith(")"):
+            tests = [parse_formula(arg) for arg in split_arguments(formula[len(function_name): -1])]
+            return lambda fields: combine(test(fields) for test in tests)
+    match = re.fullmatch(r"\{((?:[^}\\]|\\.)*)\}\s*=\s*(.+)", formula, re.DOTALL)
+    if not match:
+        raise ValueError(f"Unsupported formula: {formula}")
+    field = match.group(1).replace("\\'", "'")
+    value_match = value_pattern.fullmatch(match.group(2).strip())
+    if not value_match:
+        raise ValueError(f"Unsupported value in formula: {formula}")
+    single_quoted, double_quoted, number, boolean = value_match.groups()
+    if number is not None:
+        value = float(number)
+    elif boolean is not None:
+        value = 1.0 if boolean == "TRUE()" else 0.0
+    else:
+        value = (single_quoted if single_quoted is not None else double_quoted).replace("\\'", "'")
+
+    def test(fields):
+        # Like Airtable, compare loosely: the app matches user_id (a number) against the string from the session
+        field_value = fields.get(field)
+        if isinstance(value, float):
+            if isinstance(field_value, bool) or field_value is None:
+                field_value = float(bool(field_value))
+            try:
+                return float(field_value) == value
+            except (TypeError, ValueError):
+                return False
+        return str(field_value if field_value is not None else "") == value
+
+    return test
+
+
+def split_arguments(text: str) -> list:
+    """Splits 'a,b,AND(c,d)' on the top level commas only, ignoring commas in quotes and brackets"""
+    arguments, depth, quote, start = [], 0, None, 0
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if quote:
+            if char == "\\":
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char in "({":
+            depth += 1
+        elif char in ")}":
+            depth -= 1
+        elif char == "," and depth == 0:
+            arguments.append(text[start:i])
+            start = i + 1
+        i += 1
+    arguments.append(text[start:])
+    return arguments
+
+
+# HTTP
+class Handler(BaseHTTPRequestHandler):
+    airtable: FakeAirtable = None  # set by make_server()
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+    def log_message(self, format, *args):
+        pass  # one line per request would swamp the load test output
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PATCH(self):
+        self.handle_request("PATCH")
+
+    def do_PUT(self):
+        self.handle_request("PATCH")
+
+    def handle_request(self, method: str):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else {}
+        if self.airtable.throttle():
+            return self.send_json(429, {"errors": [{"error": "RATE_LIMIT_REACHED"}]})
+        url = urlparse(self.path)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        if len(parts) < 3 or parts[0] != "v0":
+            return self.send_json(404, {"error": "NOT_FOUND"})
+        table_name = parts[2]
+        rec_id = parts[3] if len(parts) > 3 else None
+        try:
+            if method == "GET" and rec_id:
+                return self.send_json(200, self.airtable.table(table_name)[rec_id])
+            if method == "GET":
+                return self.send_json(200, self.list_records(table_name, parse_qs(url.query)))
+            if method == "POST" and "records" in body:
+                records = [self.airtable.create(table_name, record["fields"]) for record in body["records"]]
+                return self.send_json(200, {"records": records})
+            if method == "POST":
+                return self.send_json(200, self.airtable.create(table_name, body["fields"]))
+            if method == "PATCH" and rec_id:
+                return self.send_json(200, self.airtable.update(table_name, rec_id, body["fields"]))
+            if method == "PATCH":
+                records = [
+                    self.airtable.update(table_name, record["id"], record["fields"]) for record in body["records"]
+                ]
+                return self.send_json(200, {"records": records})
+        except KeyError:
+            return self.send_json(404, {"error": "NOT_FOUND"})
+        except ValueError as e:
+            return self.send_json(422, {"error": {"type": "INVALID_FILTER_BY_FORMULA", "message": str(e)}})
+        self.send_json(405, {"error": "METHOD_NOT_ALLOWED"})
+
+    def list_records(self, table_name: str, query: dict) -> dict:
+        formula = query.get("filterByFormula", [None])[0]
+        records = self.airtable.select(table_name, formula)
+        if "maxRecords" in query:
+            records = records[: int(query["maxRecords"][0])]
+        fields = query.get("fields[]") or query.get("fields")
+        if fields:
+            records = [
+                {**record, "fields": {k: v for k, v in record["fields"].items() if k in fields}}
+                for record in records
+            ]
+        page_size = min(int(query.get("pageSize", [100])[0]), 100)
+        offset = int(query.get("offset", [0])[0])
+        page = {"records": records[offset: offset + page_size]}
+        if offset + page_size < len(records):
+            page["offset"] = str(offset + page_size)
+        return page
+
+    def send_json(self, status: int, data):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def make_server(airtable: FakeAirtable, host="127.0.0.1", port=8090) -> ThreadingHTTPServer:
+    handler = type("FakeAirtableHandler", (Handler,), {"airtable": airtable})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the Airtable REST API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--cards", type=int, default=200, help="number of cards to start with")
+    parser.add_argument("--latency-ms", type=float, default=100, help="added to every request")
+    parser.add_argument("--latency-jitter-ms", type=float, default=50, help="latency varies by up to +/- this much")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered with a 429")
+    parser.add_argument(
+        "--requests-per-second", type=float, default=0, help="answer with 429 above this rate (Airtable's is 5)"
+    )
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    options = parse_args()
+    fake = FakeAirtable(options.latency_ms, options.latency_jitter_ms, options.error_rate, options.requests_per_second)
+    fake.seed_cards(options.cards)
+    server = make_server(fake, options.host, options.port)
+    print(f"Fake Airtable serving {options.cards} cards on http://{options.host}:{options.port}/v0")
+    server.serve_forever()
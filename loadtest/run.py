@@ -0,0 +1,211 @@
+"""
+Load test: how many simultaneous reviewers can one instance of the app take?
+
+Starts the fake Airtable (loadtest/fake_airtable.py) and the app under gunicorn, then runs simulated users that
+register, log in and study: flip through cards on /, sometimes skip a card with the SkipCardForm and sometimes open
+/index. Prints throughput and p50/p95/p99 latency for each route.
+
+    python -m loadtest.run --users 20 --duration 60 --latency-ms 150
+
+Use --app-url to test an app that is already running instead (start it with AIRTABLE_API_URL pointing at a fake
+Airtable, or it will use the real one).
+"""
+
+import argparse
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+import requests
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+csrf_pattern = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+card_id_pattern = re.compile(r'name="card_id" type="hidden" value="([^"]*)"')
+
+
+class Results:
+    """Latencies and errors per route, shared by all simulated users"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)  # route -> [seconds]
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def add(self, route: str, seconds: float, ok: bool):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            if not ok:
+                self.errors[route] += 1
+
+    def report(self, elapsed: float) -> str:
+        lines = [
+            f"{'route':<22}{'requests':>9}{'errors':>8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}",
+        ]
+        all_latencies = []
+        for route in sorted(self.latencies):
+            latencies = sorted(self.latencies[route])
+            all_latencies.extend(latencies)
+            lines.append(self.format_line(route, latencies, self.errors[route], elapsed))
+        lines.append(self.format_line("all", sorted(all_latencies), sum(self.errors.values()), elapsed))
+        return "\n".join(lines)
+
+    @staticmethod
+    def format_line(route: str, latencies: list, errors: int, elapsed: float) -> str:
+        return (
+            f"{route:<22}{len(latencies):>9}{errors:>8}{len(latencies) / elapsed:>8.1f}"
+            f"{percentile(latencies, 50):>9.0f}{percentile(latencies, 95):>9.0f}{percentile(latencies, 99):>9.0f}"
+        )
+
+
+def percentile(sorted_values: list, percent: float) -> float:
+    """Nearest rank percentile, in milliseconds"""
+    if not sorted_values:
+        return 0
+    rank = max(0, min(len(sorted_values) - 1, round(percent / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank] * 1000
+
+
+class SimulatedUser(threading.Thread):
+    def __init__(self, number: int, app_url: str, results: Results, stop_time: float, options):
+        super().__init__(daemon=True)
+        self.number = number
+        self.app_url = app_url.rstrip("/")
+        self.results = results
+        self.stop_time = stop_time
+        self.options = options
+        self.session = requests.Session()
+
+    def request(self, route: str, method: str, path: str, **kwargs) -> requests.Response:
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.app_url + path, timeout=60, **kwargs)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        self.results.add(route, time.perf_counter() - start, ok)
+        return response
+
+    def csrf_token(self, response) -> str:
+        match = csrf_pattern.search(response.text) if response is not None else None
+        return match.group(1) if match else ""
+
+    def run(self):
+        email = f"loadtest-{self.number}-{random.randint(0, 10 ** 9)}@example.com"
+        password = "load-test-password"
+        form = self.request("GET /register", "GET", "/register")
+        self.request(
+            "POST /register",
+            "POST",
+            "/register",
+            data={"email": email, "password": password, "name": f"Load Test {self.number}",
+                  "csrf_token": self.csrf_token(form)},
+        )
+        self.request("GET /logout", "GET", "/logout")
+        form = self.request("GET /login", "GET", "/login")
+        self.request(
+            "POST /login", "POST", "/login",
+            data={"email": email, "password": password, "csrf_token": self.csrf_token(form)},
+        )
+        while time.time() < self.stop_time:
+            page = self.request("GET /", "GET", "/")
+            if page is not None and random.random() < self.options.skip_chance:
+                card_id = card_id_pattern.search(page.text)
+                if card_id:
+                    self.request(
+                        "POST / (skip)", "POST", f"/?card_id={card_id.group(1)}",
+                        data={"days_to_skip": random.randint(1, 5), "card_id": card_id.group(1),
+                              "csrf_token": self.csrf_token(page)},
+                    )
+            if random.random() < self.options.index_chance:
+                self.request("GET /index", "GET", "/index")
+            time.sleep(random.uniform(0, 2 * self.options.think_time))
+
+
+def start_stack(options) -> tuple:
+    """Starts the fake Airtable and the app. Returns (app_url, processes)"""
+    fake_port, app_port = options.fake_port, options.app_port
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "loadtest.fake_airtable", "--port", str(fake_port), "--cards", str(options.cards),
+         "--latency-ms", str(options.latency_ms), "--latency-jitter-ms", str(options.latency_jitter_ms),
+         "--error-rate", str(options.error_rate), "--requests-per-second", str(options.requests_per_second)],
+        cwd=repo_dir,
+    )
+    work_dir = tempfile.mkdtemp(prefix="phlashcards-loadtest-")
+    env = dict(
+        os.environ,
+        APP_DATA_DIR=work_dir,  # so the fake deck's views and uploads stay out of the app's real review log
+        AIRTABLE_API_URL=f"http://127.0.0.1:{fake_port}/v0",
+        AIRTABLE_API_KEY="loadtest",
+        AIRTABLE_BASE_ID="appLoadTest",
+        APP_SECRET_KEY="loadtest",
+        BIND=f"127.0.0.1:{app_port}",
+    )
+    app = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "wsgi:app", "-c", os.path.join(repo_dir, "gunicorn.conf.py"),
+         "--pythonpath", repo_dir, "--log-level", "warning"],
+        cwd=work_dir,
+        env=env,
+        stderr=subprocess.DEVNULL if options.quiet else None,
+    )
+    app_url = f"http://127.0.0.1:{app_port}"
+    for _ in range(100):
+        try:
+            requests.get(app_url + "/about", timeout=1)
+            break
+        except requests.RequestException:
+            time.sleep(0.2)
+    return app_url, [fake, app]
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Load test Phlashcards with simulated users")
+    parser.add_argument("--users", type=int, default=10, help="simultaneous simulated users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run for")
+    parser.add_argument("--ramp-up", type=float, default=5, help="seconds over which users start")
+    parser.add_argument("--think-time", type=float, default=0.5, help="average seconds a user spends on a card")
+    parser.add_argument("--skip-chance", type=float, default=0.1, help="chance a user skips the card they see")
+    parser.add_argument("--index-chance", type=float, default=0.05, help="chance a user opens /index after a card")
+    parser.add_argument("--app-url", help="test this running app instead of starting one")
+    parser.add_argument("--app-port", type=int, default=5055)
+    parser.add_argument("--fake-port", type=int, default=8090)
+    parser.add_argument("--cards", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--latency-jitter-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--requests-per-second", type=float, default=0)
+    parser.add_argument("--quiet", action="store_true", help="hide the app's log output")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    options = parse_args(args)
+    processes = []
+    app_url = options.app_url
+    if not app_url:
+        app_url, processes = start_stack(options)
+    results = Results()
+    start = time.time()
+    stop_time = start + options.duration
+    users = []
+    try:
+        for number in range(options.users):
+            user = SimulatedUser(number, app_url, results, stop_time, options)
+            user.start()
+            users.append(user)
+            time.sleep(options.ramp_up / options.users)
+        for user in users:
+            user.join()
+    finally:
+        for process in processes:
+            process.terminate()
+    print(f"\n{options.users} users for {options.duration:.0f} s against {app_url}")
+    print(results.report(time.time() - start))
+
+
+if __name__ == "__main__":
+    main()
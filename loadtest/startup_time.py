@@ -0,0 +1,52 @@
+"""
+Measures how long a fresh Python process takes to import main.py, and checks it against the budget in
+global_constants.py. Exits with status 1 if it's over budget. Importing main.py also sets the app up (it calls
+create_app()), so that is included.
+
+    python -m loadtest.startup_time --runs 5
+
+Each run is a new process, so nothing is already imported. Reports the fastest run, which is the least disturbed by
+whatever else the machine is doing.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+import global_constants as gc  # noqa: E402
+
+measure_script = """
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000}))
+"""
+
+
+def measure_once() -> dict:
+    env = dict(os.environ, APP_SECRET_KEY=os.environ.get("APP_SECRET_KEY", "startup-time"))
+    output = subprocess.run(
+        [sys.executable, "-c", measure_script], cwd=repo_dir, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Check app import time against the budget")
+    parser.add_argument("--runs", type=int, default=5)
+    options = parser.parse_args(args)
+    runs = [measure_once() for _ in range(options.runs)]
+    import_ms = min(run["import_ms"] for run in runs)
+    print(f"import main: {import_ms:6.0f} ms (budget {gc.IMPORT_TIME_BUDGET_MS} ms)")
+    if import_ms > gc.IMPORT_TIME_BUDGET_MS:
+        print("Over budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -19,9 +19,7 @@ Uses Python, Javascript, Flask for rendering html, jinja for variables, flask-wt
 
 import os
 import global_constants as gc
-from flask import Flask, render_template, redirect, url_for, flash, request
-from flask_bootstrap import Bootstrap
-from flask_ckeditor import CKEditor
+from flask import Flask, render_template, redirect, url_for, flash, request, send_file, abort, g, session
 import datetime as dt
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import (
@@ -32,16 +30,23 @@ from flask_login import (
     current_user,
     logout_user,
 )
-from forms import CreateCardForm, RegisterForm, LoginForm, SkipCardForm
+from forms import CreateCardForm, RegisterForm, LoginForm, SkipCardForm, ProfilerForm, BulkEditForm
+from search_index import SearchIndex
+from dedup_index import DuplicateIndex
+from study_stats import StudyStats
+from io_pool import executor, submit, batch_update_concurrently
+from review_log import ReviewLog, VIEW, SKIP
+from profiler import RequestProfiler, to_pstats, to_collapsed
+from storage import card_table, user_table, breaker
+from blob_store import BlobStore, blob_name_pattern
 from secrets import token_hex
 from functools import wraps
 import math
 import random
-from collections import namedtuple
-from pyairtable import Api, Table
-from pyairtable.formulas import match
-from flask_debugtoolbar import DebugToolbarExtension
-from bleach import clean
+import time
+import threading
+from collections import Counter, namedtuple
+from pyairtable.formulas import match, OR, EQUAL, FIELD
 import requests
 from requests.exceptions import MissingSchema, ConnectionError
 import json
@@ -51,7 +56,7 @@ from loguru import logger
 # Run Pydoc window with: python -m pydoc -p <port_number>
 
 # TODO 1: Check all routes on debug toolbar "routes" e.g. /ckeditor/static/<path:filename> for login_required
-# TODO 2: * Allow uploading images to Firebase or similar for permanent URL
+# TODO 2: ---COMPLETED--- Allow uploading images (stored locally by content hash, see blob_store.py)
 # TODO 3: HOLD: implement tags. Possibly using this: https://larainfo.com/blogs/bootstrap-5-tags-input-examples
 #             or this https://stackoverflow.com/questions/63702099/how-to-make-a-checkbox-checked-in-jinja2
 #             see this: https://github.com/yairEO/tagify#features under "Build Project"
@@ -74,7 +79,7 @@ from loguru import logger
 # TODO 19: Dark mode: https://github.com/vinorodrigues/bootstrap-dark-5
 # TODO 20: HOLD Implement offline mode from local db? Read only, but refreshed on initial fill_queue?
 # TODO 21: HOLD Implement multiple page cards/series? Bootstrap carousel?
-# TODO 22: Check for crashes when no connection to db or img_urls
+# TODO 22: ---COMPLETED--- Check for crashes when no connection to db (see storage.py) or img_urls
 
 card_datafield_names = [
     "rec_id",
@@ -96,29 +101,54 @@ Card_data = namedtuple("Card_data", card_datafield_names)
 
 cache_file = "cache.json"
 
-Flask.secret_key = token_hex(16)
-app = Flask(__name__)
-app.config["SECRET_KEY"] = os.environ.get("APP_SECRET_KEY")
-ckeditor = CKEditor(app)
-Bootstrap(app)
+search_fields = ["card_id", "title", "body", "tags", "archived"]
+stats_fields = ["card_id", "num_views", "initial_frequency", "frequency_decay", "tags", "skip_until", "archived"]
+stats_refresh_lock = threading.Lock()
+index_build_lock = threading.Lock()
 
-app.debug = True  # This is for debug toolbar
-app.config["DEBUG_TB_INTERCEPT_REDIRECTS"] = False
-toolbar = DebugToolbarExtension(app)
+app = Flask(__name__)
+# ^ Routes are registered on this app as the module is imported, and create_app() at the bottom of the module sets up
+# its extensions, so `from main import app` (flask run, gunicorn main:app, PythonAnywhere) gets a working app. What's
+# slow to set up waits for first use instead (the db connection, bleach) or is opt in (the debug toolbar), so
+# importing this module stays fast.
+login_manager = LoginManager()
+profiler = RequestProfiler(gc.PROFILER_MAX_PROFILES, gc.PROFILER_SAMPLE_INTERVAL_MS)
+# The Airtable tables (card_table, user_table) come from storage.py and connect the first time they're used
 
 # logger.add("file_{time}.log", rotation="10 MB")
 
-## CONNECT TO AIRTABLE AS DB
-airtable_api_key = os.environ.get("AIRTABLE_API_KEY")
-airtable_base_id = os.environ.get("AIRTABLE_BASE_ID")
 
-airtable_cards_table_name = "cards_table"
-airtable_user_table_name = "users_table"
-api = Api(airtable_api_key)
-card_table = Table(airtable_api_key, airtable_base_id, airtable_cards_table_name)
-user_table = Table(airtable_api_key, airtable_base_id, airtable_user_table_name)
-login_manager = LoginManager()
-login_manager.init_app(app)
+def create_app() -> Flask:
+    """Sets up the app's extensions and returns it. Runs when this module is imported, so calling it again (as wsgi.py
+    does) just returns the app"""
+    if app.extensions.get("phlashcards"):
+        return app  # already set up
+    from flask_bootstrap import Bootstrap
+    from flask_ckeditor import CKEditor
+
+    app.config["SECRET_KEY"] = os.environ.get("APP_SECRET_KEY")
+    if not app.config["SECRET_KEY"]:
+        app.config["SECRET_KEY"] = token_hex(16)
+        logger.warning(
+            "APP_SECRET_KEY is not set. Using a random key, so logins won't survive a restart or work across workers"
+        )
+    app.config["MAX_CONTENT_LENGTH"] = gc.IMAGE_UPLOAD_MAX_BYTES + 1024 * 1024  # room for the rest of the card form
+    CKEditor(app)
+    Bootstrap(app)
+    login_manager.init_app(app)
+
+    if os.environ.get("DEBUG_TOOLBAR"):
+        # The toolbar imports a lot (sqlalchemy, pkg_resources...) and slows every page, so it's opt in
+        from flask_debugtoolbar import DebugToolbarExtension
+
+        app.debug = True  # This is for debug toolbar
+        app.config["DEBUG_TB_INTERCEPT_REDIRECTS"] = False
+        DebugToolbarExtension(app)
+
+    if os.environ.get("PROFILER_ENABLED"):
+        profiler.init_app(app, is_admin)
+    app.extensions["phlashcards"] = True
+    return app
 
 
 class User(UserMixin):
@@ -177,6 +207,7 @@ class Schedule:
         self.queue = []
         self.eligible_cards = []
         self.excluded_tags = ["Language"]
+        self.lock = threading.RLock()  # requests are served by several threads, which all share this schedule
 
     @logger.catch()
     def fill_queue(self):
@@ -194,18 +225,22 @@ class Schedule:
                 ]
             )
             card_data = [add_missing(card) for card in card_data_raw]
+            pending_views = review_log.pending_views()
             logger.debug(
                 f"Retrieved Card_data from db: {len(card_data)} items. First item: {card_data[0]}"
             )
         except ConnectionError:
-            logger.error("Connection Error: Unable to reach database.")
+            logger.error("Connection Error: Unable to reach database. Queue not refilled.")
             flash("Connection Error: Unable to reach database.")
-            # TODO: Load cached data
-            # card_data = read_cache()
+            return
+            # ^ storage.py serves the last card data it loaded when the db is down, so we only get here if there is none
         # Unpack json into a bunch of lists.
         rec_ids = [card["rec_id"] for card in card_data]
         card_ids = [card["card_id"] for card in card_data]
-        num_views = [card["num_views"] for card in card_data]
+        num_views = [
+            (card["num_views"] or 0) + pending_views[card["card_id"]]
+            for card in card_data
+        ]  # ^ views not yet pushed to the db (logged or compacted) count too
         frequency_decay = [card["frequency_decay"] for card in card_data]
         initial_frequencies = [
             card["initial_frequency"]
@@ -294,15 +329,22 @@ class Schedule:
 
     @logger.catch()
     def get_next_card(self) -> Card_data:
-        if not self.queue:  # Queue is empty when the app first opens
-            self.fill_queue()
-
-        self.index += 1
-        if self.index == gc.QUEUE_SIZE:
-            self.update_db()
-            self.fill_queue()
-            self.index = 0
-        next_card = self.queue[self.index]
+        with self.lock:
+            if not self.queue:  # Queue is empty when the app first opens
+                self.fill_queue()
+                if not self.queue:
+                    return None  # no cards, or couldn't reach the db
+
+            self.index += 1
+            if self.index == gc.QUEUE_SIZE:
+                old_queue = list(self.queue)  # fill_queue() clears self.queue, so update_db() gets a copy
+                submit(lambda: self.update_db(old_queue))
+                # ^ in the background, not waited for while holding self.lock: it can take several round trips when
+                # it compacts the review log. Reading the deck doesn't need to wait for it either, since cards in the
+                # old queue can't be picked for the new one.
+                self.fill_queue()
+                self.index = 0
+            next_card = self.queue[self.index]
         logger.info(
             f"Next card: {next_card.card_id}. "
             f"Num_views: {next_card.num_views}, "
@@ -314,43 +356,98 @@ class Schedule:
         return next_card
 
     @logger.catch()
-    def skip_card(self, card_id: int, days_to_skip: int):
+    def skip_card(self, card_id: int, days_to_skip: int) -> bool:
+        """Returns whether the card was skipped. Only cards still in the queue can be"""
         # TODO Next: Modify this function to find card in db, not in queue, commit change right away
-
-        try:
-            queue_position = [
-                i for i, card in enumerate(self.queue) if card.card_id == card_id
-            ][0]
-            logger.debug(f"Found card to skip in queue position {queue_position}")
-            self.queue[queue_position] = self.queue[queue_position]._replace(
-                skip_until=str(dt.date.today() + dt.timedelta(days=days_to_skip))
-            )
-            logger.debug(
-                f"Changed card {card_id}'s skip until to {str(dt.date.today() + dt.timedelta(days=days_to_skip))}"
-            )
-            # ^ named tuples are immutable so must replace the whole tuple
-        except IndexError:
-            logger.error(f"Index Error while skipping card {card_id}. Not skipping.")
-
-    def update_db(self):
+        with self.lock:
+            try:
+                queue_position = [
+                    i for i, card in enumerate(self.queue) if card.card_id == card_id
+                ][0]
+                logger.debug(f"Found card to skip in queue position {queue_position}")
+                self.queue[queue_position] = self.queue[queue_position]._replace(
+                    skip_until=str(dt.date.today() + dt.timedelta(days=days_to_skip))
+                )
+                logger.debug(
+                    f"Changed card {card_id}'s skip until to {str(dt.date.today() + dt.timedelta(days=days_to_skip))}"
+                )
+                # ^ named tuples are immutable so must replace the whole tuple
+                return True
+            except IndexError:
+                logger.error(f"Index Error while skipping card {card_id}. Not skipping.")
+                return False
+
+    def update_db(self, cards: list = None):
+        """Writes skip_until back to the db for skipped cards (default: the cards in the queue). Views are recorded in
+        the review log instead, and added to num_views in the db when the log is compacted."""
+        if cards is None:
+            cards = self.queue
+        today = dt.date.today()
         updates_list = [
             {
                 "id": card.rec_id,
                 "fields": {
-                    "num_views": card.num_views + 1,
                     "skip_until": card.skip_until,
                 },
             }
-            for card in self.queue
+            for card in cards
+            if dt.datetime.strptime(card.skip_until, "%Y-%m-%d").date() > today
+            # ^ cards in the queue were all due, so only the ones skipped since have a skip_until in the future
         ]
         logger.debug(f"Updates list: {updates_list}")
         try:
-            card_table.batch_update(updates_list)
+            if updates_list:
+                card_table.batch_update(updates_list)
         except ConnectionError:
-            logger.error("Connection Error: Unable to reach database. Number of views not updated")
-            flash("Error connecting to database. Number of views not updated")
+            logger.error("Connection Error: Unable to reach database. Skipped cards not updated")
+            flash("Error connecting to database. Skipped cards not updated")
+        compact_review_log()
+
 
 # HELPER FUNCTIONS
+def clean(text, **kwargs):
+    """bleach.clean(). bleach is only imported when first needed, since it's slow to import"""
+    from bleach import clean as bleach_clean
+
+    return bleach_clean(text, **kwargs)
+
+
+@logger.catch()
+def compact_review_log():
+    """If it's time, folds the review log into per-user counters and adds the new views to num_views in the db.
+    This costs one read per FORMULA_MAX_CARDS viewed cards plus one batch update per 10 cards, however many
+    views there were."""
+    if breaker.is_open or not review_log.due_for_compaction(gc.REVIEW_LOG_COMPACT_EVENTS, gc.REVIEW_LOG_COMPACT_SECONDS):
+        return
+    views_to_push = review_log.take_unpushed(gc.REVIEW_LOG_PUSH_TIMEOUT)  # compacts the log too
+    if not views_to_push:
+        return  # nothing new, or another process is pushing
+    card_ids = list(views_to_push)
+    updates_list = []
+    table = card_table.get_table()
+    # ^ The pyairtable Table itself, not card_table: num_views must be read fresh, never from the stale copies
+    # storage.py serves when a read fails, and the write must fail rather than be queued, since replaying an absolute
+    # num_views later could overwrite views pushed since.
+    try:
+        for i in range(0, len(card_ids), gc.FORMULA_MAX_CARDS):
+            formula = OR(*[EQUAL(FIELD("card_id"), card_id) for card_id in card_ids[i: i + gc.FORMULA_MAX_CARDS]])
+            for card in table.all(fields=["card_id", "num_views"], formula=formula):
+                card = add_missing(card)
+                updates_list.append(
+                    {
+                        "id": card["rec_id"],
+                        "fields": {"num_views": (card["num_views"] or 0) + views_to_push[card["card_id"]]},
+                    }
+                )
+        table.batch_update(updates_list)
+    except requests.RequestException as e:
+        logger.error(f"Unable to update database: {e!r}. Number of views will be updated next time")
+        review_log.push_failed(views_to_push)
+        return
+    review_log.mark_pushed(views_to_push)
+    logger.info(f"Added views to num_views in db for {len(updates_list)} cards")
+
+
 @logger.catch()
 def check_is_url_image(image_url):
     image_formats = ("image/png", "image/jpeg", "image/jpg")
@@ -380,18 +477,40 @@ def check_is_url_image(image_url):
 
 
 @logger.catch()
-def sanitize(raw_title, raw_body, raw_img_url):
+def sanitize(raw_title, raw_body, raw_img_url, img_upload=None):
     """uses library bleach to remove html tags (including malicious scripts) and performs other checks on form input
-    There are no checks within db or on output."""
+    There are no checks within db or on output. An uploaded image replaces the image URL."""
     img_url = ""
     # body = clean(raw_body, tags=['em', 'i', 'br'], strip=True)
     body = clean(raw_body, tags=["em", "p", "br", "i"], strip=True)
     title = clean(raw_title, strip=True)
-    if raw_img_url:
+    if img_upload:
+        img_url = save_uploaded_image(img_upload)
+    elif raw_img_url and is_uploaded_image_url(raw_img_url):
+        img_url = raw_img_url  # checked when it was uploaded, and its contents can't change
+    elif raw_img_url:
         img_url = check_is_url_image(raw_img_url)
     return title, body, img_url
 
 
+def save_uploaded_image(img_upload):
+    """Saves an uploaded image in the image store and returns its URL, or None if it isn't a usable image"""
+    try:
+        name = image_store.save(img_upload.stream)
+    except ValueError as e:
+        flash(f"Image not saved. {e}")
+        logger.error(f"Image upload {img_upload.filename} not saved: {e}")
+        return None
+    logger.info(f"Saved uploaded image {img_upload.filename} as {name}")
+    return url_for("uploaded_image", name=name)
+
+
+def is_uploaded_image_url(img_url: str) -> bool:
+    """Whether img_url is a URL save_uploaded_image() could have returned"""
+    name = img_url.rsplit("/", 1)[-1]
+    return bool(blob_name_pattern.fullmatch(name)) and img_url == url_for("uploaded_image", name=name)
+
+
 @logger.catch()
 def default_if_none(
     freq_decay=gc.FREQUENCY_DECAY_DEFAULT,
@@ -475,10 +594,125 @@ def read_cache():
         return card_json
 
 
+def get_search_index() -> SearchIndex:
+    """Returns the search index, or None until it's built. The first call starts building it in the background"""
+    if not search_index.is_built:
+        start_index_build()
+        return None
+    return search_index
+
+
+def get_duplicate_index() -> DuplicateIndex:
+    """Returns the duplicate index, or None until it's built. The first call starts building it in the background"""
+    if not duplicate_index.is_built:
+        start_index_build()
+        return None
+    return duplicate_index
+
+
+def start_index_build(cards: list = None):
+    """Builds the search and duplicate indexes that aren't built yet on the io pool, from cards (dicts from
+    add_missing()) or else from the db. For a big deck that's many pages of card_table.all() plus seconds of hashing,
+    far too long to keep a request waiting."""
+    if not index_build_lock.locked():
+        executor.submit(logger.catch()(build_indexes), cards)
+
+
+def build_indexes(cards: list = None):
+    if not index_build_lock.acquire(blocking=False):
+        return  # another thread is already building them
+    try:
+        if cards is None:
+            cards = [add_missing(card) for card in card_table.all(fields=search_fields)]
+        if not search_index.is_built:
+            search_index.build(cards)
+        if not duplicate_index.is_built:
+            duplicate_index.build(cards)
+    finally:
+        index_build_lock.release()
+
+
+def stats_card(card: dict, pending_views: Counter) -> dict:
+    """A card dict with the views not yet written to the db (from review_log.pending_views()) added to num_views, for
+    study_stats"""
+    return dict(card, num_views=(card["num_views"] or 0) + pending_views[card["card_id"]])
+
+
+def refresh_study_stats():
+    """Recounts the /stats totals from the db. Does nothing if another thread is already doing it"""
+    if not stats_refresh_lock.acquire(blocking=False):
+        return
+    try:
+        card_data_raw = card_table.all(fields=stats_fields)
+        pending_views = review_log.pending_views()
+        study_stats.build([stats_card(add_missing(card), pending_views) for card in card_data_raw])
+    finally:
+        stats_refresh_lock.release()
+
+
+def flash_duplicates(title: str, body: str, card_id: int = None):
+    """Warns the user if a card with this title and body looks like a copy of another card. Says nothing while the
+    duplicate index is still being built"""
+    index = get_duplicate_index()
+    if index is None:
+        logger.info("Duplicate index not built yet. Skipped duplicate check.")
+        return
+    start = time.perf_counter()
+    duplicates = index.find_duplicates(title, body, exclude_card_id=card_id)
+    logger.debug(f"Duplicate check: {len(duplicates)} found in {(time.perf_counter() - start) * 1000:.2f} ms")
+    if duplicates:
+        listed = ", ".join(
+            f"#{duplicate.card_id} {duplicate.title} ({duplicate.similarity:.0%} similar)"
+            for duplicate in duplicates[:gc.DUPLICATES_LISTED_MAX]
+        )
+        flash(f"This card looks like a duplicate of: {listed}")
+
+
+def select_cards(select_by: str, selection: str) -> list:
+    """Returns card_id, tags and archived of the cards with a tag, or with card_ids from a space separated list"""
+    fields = ["card_id", "tags", "archived"]
+    if select_by == "tag":
+        tag = selection.strip()
+        # Filtering locally is simplest since tags are one space separated string. This only loads three small
+        # fields per card, like fill_queue() does.
+        cards = [add_missing(card) for card in card_table.all(fields=fields)]
+        return [card for card in cards if card["tags"] and tag in card["tags"].split(" ")]
+    card_ids = [int(card_id) for card_id in selection.split()]
+    cards = []
+    for i in range(0, len(card_ids), gc.FORMULA_MAX_CARDS):
+        formula = OR(*[EQUAL(FIELD("card_id"), card_id) for card_id in card_ids[i: i + gc.FORMULA_MAX_CARDS]])
+        cards.extend(add_missing(card) for card in card_table.all(fields=fields, formula=formula))
+    return cards
+
+
+def bulk_edit_fields(operation: str, value: str, card: dict) -> dict:
+    """Returns the fields to change on one card for a bulk edit operation"""
+    new_tags = value.split()
+    old_tags = card["tags"].split() if card["tags"] else []
+    if operation == "archive":
+        return {"archived": True}
+    if operation == "unarchive":
+        return {"archived": False}
+    if operation == "add_tags":
+        return {"tags": " ".join(old_tags + [tag for tag in new_tags if tag not in old_tags])}
+    if operation == "remove_tags":
+        return {"tags": " ".join(tag for tag in old_tags if tag not in new_tags)}
+    if operation == "set_tags":
+        return {"tags": " ".join(new_tags)}
+    if operation == "set_frequency":
+        return {"initial_frequency": int(value)}
+    if operation == "set_decay":
+        return {"frequency_decay": int(value)}
+    if operation == "reset_views":
+        return {"num_views": 0}
+    raise ValueError(f"Unknown bulk edit operation {operation}")
+
+
 # This function is required by Flask Login Manager.
 @logger.catch()
 @login_manager.user_loader
 def load_user(id):
+    user = None  # Flask Login treats this as not logged in
     try:
         user_data = user_table.first(formula=match({"user_id": id}))["fields"]
         user = User(
@@ -536,6 +770,8 @@ def register():
             user_data_raw = user_table.first(formula=formula)
         except ConnectionError:
             logger.error("Connection error. Unable to connect to database.")
+            flash("Error connecting to database")
+            return render_template("register.html", form=form)
         if user_data_raw:
             user_data = user_data_raw["fields"]
             logger.error(
@@ -552,6 +788,8 @@ def register():
                 },
             )
             logger.info(f"Registered new user with database: {response_from_db}")
+            if not response_from_db:  # queued until the db is back (see storage.py)
+                return redirect(url_for("login"))
             user_data = response_from_db["fields"]
             user = User(
                 id=user_data["user_id"],
@@ -579,13 +817,17 @@ def login():
         # user = User.query.filter_by(email=request.form.get('email').lower()).first()
         formula = match({"email": request.form.get("email")})
         try:
-            user_data = user_table.first(formula=formula)["fields"]
+            user_data_raw = user_table.first(formula=formula)
         except ConnectionError:
             logger.error(
                 "Connection error. Error connecting to database (e.g too many retries"
             )
             flash("Error connecting to database")
             return redirect(url_for("login"))
+        if not user_data_raw:
+            flash("Email not registered")
+            return redirect(url_for("login"))
+        user_data = user_data_raw["fields"]
         user = User(
             id=user_data["user_id"],
             user_name=user_data["user_name"],
@@ -619,24 +861,39 @@ def logout():
 @app.route("/", methods=["GET", "POST"])
 @logged_in_only
 def show_card():
-    card_id = request.args.get("card_id")
-    if not card_id:
-        card_id = sched.get_next_card().card_id
+    card_future = g.pop("card_future", None)  # see prefetch_card()
     try:
-        requested_card_raw = card_table.first(formula=match({"card_id": card_id}))
-        requested_card = add_missing(requested_card_raw)
+        card_id, requested_card_raw, is_scheduled = (
+            card_future.result() if card_future else fetch_card(request.args.get("card_id"))
+        )
         # logger_text = 'Retrieved card:\n{}'.format("\n".join([str(requested_card[field]) for field
         # in requested_card.keys() if field != "body"]))
         # logger.debug(logger_text)
     except ConnectionError:
         logger.error("Unable to connect to database.")
+        flash("Unable to connect to database.")
+        return no_card_page()
+    if not card_id:
+        return no_card_page()  # nothing scheduled
+    if is_scheduled:
+        review_log.record(current_user.id, card_id, VIEW)
+        study_stats.record_view(card_id)
+    if not requested_card_raw:
+        flash("404: Link does not exist/no such card")
+        logger.error(f"404: No card {card_id}")
+        return no_card_page()
+    requested_card = add_missing(requested_card_raw)
     skip_form = SkipCardForm(days_to_skip=1, card_id=card_id)
     if skip_form.validate_on_submit():
         logger.debug(
             f"received back from form - card: {skip_form.card_id.data}, type: {type(skip_form.card_id.data)}, "
             f"days to skip: {skip_form.days_to_skip.data}, type: {type(skip_form.days_to_skip.data)}"
         )
-        sched.skip_card(int(skip_form.card_id.data), skip_form.days_to_skip.data)
+        if sched.skip_card(int(skip_form.card_id.data), skip_form.days_to_skip.data):
+            review_log.record(current_user.id, int(skip_form.card_id.data), SKIP)
+            study_stats.record_skip(
+                int(skip_form.card_id.data), str(dt.date.today() + dt.timedelta(days=skip_form.days_to_skip.data))
+            )
         return redirect(url_for("show_card", card_id=card_id))
     logger.debug(
         f'Card data passed to template: Card {requested_card["card_id"]}: {requested_card["title"]}'
@@ -651,6 +908,40 @@ def show_card():
     )
 
 
+def fetch_card(card_id) -> tuple:
+    """Gets the next card from the schedule if card_id is empty, then the card's record from the db.
+    Returns (card_id, record, whether the card came from the schedule). card_id is None if nothing is scheduled, and
+    record is None if there's no such card."""
+    is_scheduled = not card_id
+    if is_scheduled:
+        next_card = sched.get_next_card()
+        if not next_card:
+            return None, None, True
+        card_id = next_card.card_id
+    return card_id, card_table.first(formula=match({"card_id": card_id})), is_scheduled
+
+
+@app.before_request
+def prefetch_card():
+    """For show_card, starts fetching the card while Flask-Login loads the user, since neither needs the other. Only
+    for sessions that have a logged in user, so anonymous requests don't touch the schedule or the db."""
+    if request.endpoint == "show_card" and session.get("_user_id"):
+        card_id = request.args.get("card_id")
+        g.card_future = submit(lambda: fetch_card(card_id))
+
+
+def no_card_page():
+    """Shown instead of a card when there isn't one to show. (Redirecting to /login or /index could loop, since they
+    redirect back here.)"""
+    return render_template(
+        "index.html",
+        all_cards=[],
+        all_tags=set(),
+        logged_in=current_user.is_authenticated,
+        is_admin=is_admin(),
+    )
+
+
 @logger.catch()
 @app.route("/index", methods=["GET", "POST"])
 # @logged_in_only
@@ -680,6 +971,8 @@ def get_all_cards():
             # ^ Is essentially a nested loop, i.e. for sublist in all_tags_nested: for item in sublist: yield item
             logger.debug(f"All tags {all_tags}")
             logger.debug(f"A few records: {card_data[:3]}")
+            if not (search_index.is_built and duplicate_index.is_built):
+                start_index_build(card_data)  # we already have every card, so save the build reading them again
             return render_template(
                 "index.html",
                 all_cards=card_data,
@@ -708,7 +1001,7 @@ def add_new_card():
     if form.validate_on_submit():
         # clean responses, insert defaults for None
         title, body, img_url = sanitize(
-            form.title.data, form.body.data, form.img_url.data
+            form.title.data, form.body.data, form.img_url.data, form.img_upload.data
         )
         body = body.replace("\n\n\n", "\n\n")
         logger.debug(
@@ -732,6 +1025,7 @@ def add_new_card():
             f"Attempting to create card with title: {title}, img_url: {img_url}, author "
             f"{current_user.user_name}, freq_decay: {frequency_decay}, tags: {tags}, "
             f"num_views: {num_views}, init_freq: {initial_frequency}, skip_until: {skip_until}, body: {body}")
+        flash_duplicates(title, body)  # before creating, so a first-time build of the index doesn't include the new card
         try:
             response = card_table.create(
                 {
@@ -747,12 +1041,17 @@ def add_new_card():
                 }
             )
             logger.info(f"New card created. Response: {response}")
+            if not response:  # queued until the db is back (see storage.py)
+                return redirect(url_for("show_card"))
             new_card = add_missing(response)
             flash("New card created successfully")
+            search_index.update_card(new_card)
+            duplicate_index.update_card(new_card)
+            study_stats.update_card(new_card)
             return redirect(url_for("show_card", card_id=new_card["card_id"]))
         except ConnectionError:
             logger.error(
-                f"Connection Error. Unable to connect to database. Response {response}"
+                f"Connection Error. Unable to connect to database."
             )
             flash(f"Connection Error. Unable to connect to database. Card not added.")
     return render_template("new-card.html", form=form)
@@ -764,10 +1063,12 @@ def add_new_card():
 def edit_card(card_id):
     # Get existing card data from db and make the edit form
     formula = match({"card_id": card_id})
+    card_data_raw = None
     try:
         card_data_raw = card_table.first(formula=formula)
     except ConnectionError:
         logger.error("Unable to connect to database")
+        flash("Unable to connect to database")
     if card_data_raw:
         card = add_missing(card_data_raw)
         logger.debug(f"Retrieved card to edit from database: {card}")
@@ -794,7 +1095,7 @@ def edit_card(card_id):
     # Update the db with the edited card data
     if edit_form.validate_on_submit():
         title, body, img_url = sanitize(
-            edit_form.title.data, edit_form.body.data, edit_form.img_url.data
+            edit_form.title.data, edit_form.body.data, edit_form.img_url.data, edit_form.img_upload.data
         )
         (
             frequency_decay,
@@ -829,6 +1130,12 @@ def edit_card(card_id):
                 },
             )
             logger.info(f"Card updated successfully. Response: {response}")
+            if response:  # None if queued until the db is back (see storage.py)
+                edited_card = add_missing(response)
+                flash_duplicates(title, body, card_id=card_id)
+                search_index.update_card(edited_card)
+                duplicate_index.update_card(edited_card)
+                study_stats.update_card(stats_card(edited_card, review_log.pending_views()))
         except ConnectionError:
             logger.error(
                 f"Connection Error. Unable to connect to database."
@@ -848,17 +1155,192 @@ def edit_card(card_id):
 @app.route("/archive-card/<int:card_id>")
 @admin_only
 def archive_card(card_id):
-    rec_id = card_table.first(formula=match({"card_id": card_id}))["id"]
-    logger.debug(f"Found card to archive. Rec ID is: {rec_id}")
     try:
+        rec_id = card_table.first(formula=match({"card_id": card_id}))["id"]
+        logger.debug(f"Found card to archive. Rec ID is: {rec_id}")
         card_table.update(rec_id, {"archived": True})
         logger.info(f"Card {card_id} archived successfully")
+        search_index.remove_card(card_id)
+        duplicate_index.remove_card(card_id)
+        study_stats.archive_card(card_id)
     except ConnectionError:
         flash("Unable to connect to database")
         logger.error("Unable to connect to database")
     return redirect(url_for("show_card"))
 
 
+@logger.catch()
+@app.route("/search")
+@logged_in_only
+def search():
+    query = request.args.get("q", "")
+    results = []
+    if query:
+        index = get_search_index()
+        if index is None:
+            results = None  # not "no matches"
+            flash("Search is still getting ready. Try again in a moment.")
+        else:
+            start = time.perf_counter()
+            results = index.search(query, limit=gc.SEARCH_RESULTS_MAX)
+            logger.debug(f"Search for '{query}': {len(results)} results in {(time.perf_counter() - start) * 1000:.2f} ms")
+    return render_template(
+        "search.html",
+        query=query,
+        results=results,
+        logged_in=current_user.is_authenticated,
+        is_admin=is_admin(),
+    )
+
+
+@logger.catch()
+@app.route("/admin/bulk-edit", methods=["GET", "POST"])
+@admin_only
+def bulk_edit():
+    form = BulkEditForm()
+    if form.validate_on_submit():
+        operation = form.operation.data
+        value = clean(form.value.data or "", strip=True)
+        limits = {"set_frequency": gc.INITIAL_FREQUENCY_MAX, "set_decay": gc.FREQUENCY_DECAY_RATE_MAX}
+        if operation in limits and not (value.isdigit() and 1 <= int(value) <= limits[operation]):
+            flash(f"Value must be a whole number from 1 to {limits[operation]}")
+            return render_template("bulk-edit.html", form=form)
+        if operation in ("add_tags", "remove_tags") and not value:
+            flash("Enter the tags to add or remove")
+            return render_template("bulk-edit.html", form=form)
+        try:
+            cards = select_cards(form.select_by.data, form.selection.data)
+        except ValueError:
+            flash("Card numbers must be whole numbers separated by spaces")
+            return render_template("bulk-edit.html", form=form)
+        except ConnectionError:
+            flash("Unable to connect to database")
+            logger.error("Unable to connect to database")
+            return render_template("bulk-edit.html", form=form)
+        updates_list = [
+            {"id": card["rec_id"], "fields": bulk_edit_fields(operation, value, card)} for card in cards
+        ]
+        logger.debug(f"Bulk edit {operation} '{value}' on {len(updates_list)} cards")
+        updated_records, failed_updates, error = batch_update_concurrently(card_table, updates_list)
+        updated_cards = [add_missing(card) for card in updated_records]
+        # The cards that were updated are updated whatever happened to the others, so keep the indexes in step
+        for card in updated_cards:
+            search_index.update_card(card)
+            duplicate_index.update_card(card)  # only re-hashes unarchived cards, since bulk edits leave title and body alone
+        if operation == "reset_views":
+            # Views logged before the reset shouldn't be added back on top of the new 0
+            failed_rec_ids = {update["id"] for update in failed_updates}
+            review_log.forget_views([card["card_id"] for card in cards if card["rec_id"] not in failed_rec_ids])
+        pending_views = review_log.pending_views()
+        for card in updated_cards:
+            study_stats.update_card(stats_card(card, pending_views))
+        if error is not None:
+            if not isinstance(error, requests.RequestException):
+                raise error
+            flash(f"Updated {len(updated_cards)} cards. The other {len(failed_updates)} could not be updated: {error}")
+            logger.error(f"Bulk edit {operation}: {len(failed_updates)} cards not updated. {error}")
+            return render_template("bulk-edit.html", form=form)
+        logger.info(f"Bulk edit {operation} applied to {len(updated_cards)} cards")
+        flash(f"Updated {len(updated_cards)} cards")
+        return redirect(url_for("bulk_edit"))
+    return render_template("bulk-edit.html", form=form)
+
+
+@logger.catch()
+@app.route("/admin/profiler", methods=["GET", "POST"])
+@admin_only
+def profiler_settings():
+    form = ProfilerForm(
+        mode=profiler.mode,
+        endpoints=" ".join(sorted(profiler.endpoints)),
+        user_ids=" ".join(str(user_id) for user_id in sorted(profiler.user_ids)),
+        sample_rate=profiler.sample_rate,
+        allow_header=profiler.allow_header,
+    )
+    if form.validate_on_submit():
+        try:
+            user_ids = {int(user_id) for user_id in form.user_ids.data.split()}
+        except ValueError:
+            flash("User ids must be whole numbers")
+            return redirect(url_for("profiler_settings"))
+        profiler.configure(
+            mode=form.mode.data,
+            endpoints=set(form.endpoints.data.split()),
+            user_ids=user_ids,
+            sample_rate=form.sample_rate.data or 0.0,
+            allow_header=form.allow_header.data,
+        )
+        logger.info(f"Profiler settings changed by user {current_user.id}")
+        flash("Profiler settings saved")
+        return redirect(url_for("profiler_settings"))
+    return render_template(
+        "profiler.html",
+        form=form,
+        profiles=list(profiler.profiles)[::-1],  # newest first
+        is_enabled=profiler.is_enabled,
+        process_id=os.getpid(),  # settings and profiles belong to this worker process only
+        logged_in=current_user.is_authenticated,
+        is_admin=is_admin(),
+    )
+
+
+@logger.catch()
+@app.route("/admin/profiler/<int:profile_id>")
+@admin_only
+def download_profile(profile_id):
+    profile = profiler.get(profile_id)
+    if not profile:
+        flash("404: No such profile. Only the most recent profiles are kept.")
+        return redirect(url_for("profiler_settings"))
+    if profile.mode == "cprofile":
+        data, extension = to_pstats(profile), "pstats"
+    else:
+        data, extension = to_collapsed(profile), "collapsed"
+    return send_file(
+        data,
+        mimetype="application/octet-stream",
+        as_attachment=True,
+        attachment_filename=f"profile-{profile_id}-{profile.endpoint}.{extension}",
+    )
+
+
+@app.route("/img/<name>")
+def uploaded_image(name):
+    try:
+        path = os.path.abspath(image_store.path(name))
+    except ValueError:
+        abort(404)
+    if not os.path.exists(path):
+        abort(404)
+    # conditional=True answers Range and If-None-Match requests. The name is a hash of the contents, so browsers can
+    # keep the image forever.
+    response = send_file(path, conditional=True, cache_timeout=gc.IMAGE_CACHE_SECONDS)
+    response.headers["Cache-Control"] = f"public, max-age={gc.IMAGE_CACHE_SECONDS}, immutable"
+    return response
+
+
+@logger.catch()
+@app.route("/stats")
+@logged_in_only
+def stats():
+    if not study_stats.is_built:
+        try:
+            refresh_study_stats()
+        except ConnectionError:
+            flash("Unable to establish connection with db. No statistics yet.")
+            logger.error("Unable to establish connection with db. Study stats not built.")
+    elif study_stats.is_stale(gc.STATS_REBUILD_SECONDS):
+        executor.submit(logger.catch()(refresh_study_stats))  # this page shows the current totals meanwhile
+    return render_template(
+        "stats.html",
+        stats=study_stats.summary(),
+        max_infrequency=gc.MAX_INFREQUENCY,
+        weight_bucket=gc.STATS_WEIGHT_BUCKET,
+        logged_in=current_user.is_authenticated,
+        is_admin=is_admin(),
+    )
+
+
 @app.route("/about")
 def about():
     return render_template("about.html")
@@ -871,6 +1353,17 @@ def contact():
 
 
 sched = Schedule()
+data_dir = os.environ.get("APP_DATA_DIR") or app.root_path
+# ^ for the review log and uploads. Next to main.py by default rather than wherever the server was started from, so
+# every worker and restart uses the same files
+review_log = ReviewLog(os.path.join(data_dir, gc.REVIEW_LOG_FILE), os.path.join(data_dir, gc.REVIEW_COUNTS_FILE))
+search_index = SearchIndex()
+duplicate_index = DuplicateIndex(gc.DUPLICATE_SIMILARITY)
+study_stats = StudyStats(get_weight)
+image_store = BlobStore(
+    os.path.join(data_dir, gc.IMAGE_STORE_DIR), gc.IMAGE_UPLOAD_CHUNK_BYTES, gc.IMAGE_UPLOAD_MAX_BYTES
+)
+create_app()
 
 if __name__ == "__main__":
     app.run(host="127.0.0.1", port=5001)
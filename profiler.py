@@ -0,0 +1,170 @@
+"""
+On-demand request profiler for admins.
+
+Profiles requests chosen by route, by user or by a request header (from the admin only), and keeps the last few
+profiles in memory so an admin can download them from /admin/profiler:
+ * "cprofile" mode records every function call and downloads as a .pstats file (open with pstats or snakeviz)
+ * "sample" mode samples the request's stack every few ms and downloads as collapsed stacks ("a;b;c 12" lines), the
+   input format of flamegraph.pl and speedscope
+
+Nothing is installed unless PROFILER_ENABLED is set, so when it's off requests don't pay for it at all.
+
+Settings and profiles live in the process, like the Schedule. Under gunicorn with several workers, run with
+WEB_CONCURRENCY=1 while profiling, or each worker only has the settings and profiles of the requests it served.
+"""
+
+import cProfile
+import io
+import itertools
+import marshal
+import random
+import sys
+import threading
+import time
+from collections import deque, namedtuple, Counter
+from flask import g, request
+from flask_login import current_user
+from loguru import logger
+
+Profile = namedtuple(
+    "Profile", ["profile_id", "timestamp", "method", "path", "endpoint", "user_id", "duration_ms", "mode", "data"]
+)
+# ^ data is the pstats dict (cprofile mode) or a Counter of collapsed stacks (sample mode)
+
+PROFILE_HEADER = "X-Profile"
+
+
+class StackSampler(threading.Thread):
+    """Samples another thread's stack until stopped, counting identical stacks"""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self) -> Counter:
+        self.stopped.set()
+        self.join()
+        return self.stacks
+
+
+class RequestProfiler:
+    def __init__(self, max_profiles: int, sample_interval_ms: float):
+        self.profiles = deque(maxlen=max_profiles)
+        self.sample_interval = sample_interval_ms / 1000
+        self.mode = "cprofile"
+        self.endpoints = set()  # profile every request to these view functions, e.g. "show_card"
+        self.user_ids = set()  # profile every request from these users
+        self.sample_rate = 0.0  # fraction of all other requests to profile
+        self.allow_header = False  # profile the admin's requests sent with the X-Profile header
+        self.is_admin = None  # main.is_admin, passed in to avoid a circular import
+        self.is_enabled = False
+        self.next_id = itertools.count(1)
+        self.cprofile_lock = threading.Lock()  # only one cProfile can be active at a time
+
+    def init_app(self, app, is_admin):
+        self.is_admin = is_admin
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._stop_if_failed)
+        self.is_enabled = True
+        logger.info("Request profiler enabled")
+
+    def configure(self, mode: str, endpoints: set, user_ids: set, sample_rate: float, allow_header: bool):
+        self.mode = mode
+        self.endpoints = endpoints
+        self.user_ids = user_ids
+        self.sample_rate = sample_rate
+        self.allow_header = allow_header
+
+    def get(self, profile_id: int):
+        for profile in self.profiles:
+            if profile.profile_id == profile_id:
+                return profile
+        return None
+
+    def _is_selected(self, user_id) -> bool:
+        if request.endpoint in self.endpoints:
+            return True
+        if self.allow_header and request.headers.get(PROFILE_HEADER) and self.is_admin():
+            return True  # anyone can send the header, and profiling all their requests would slow the whole server
+        if user_id is not None and user_id in self.user_ids:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _start(self):
+        if request.endpoint == "static":
+            return
+        user_id = self._current_user_id() if self.user_ids else None
+        if not self._is_selected(user_id):
+            return
+        g.profile_start = time.perf_counter()
+        g.profile_user_id = user_id
+        if self.mode == "sample":
+            g.profile_sampler = StackSampler(threading.get_ident(), self.sample_interval)
+            g.profile_sampler.start()
+        elif self.cprofile_lock.acquire(blocking=False):
+            g.profile_cprofile = cProfile.Profile()
+            g.profile_cprofile.enable()
+        else:
+            logger.debug(f"Another request is being profiled. Not profiling {request.path}")
+
+    def _finish(self, response):
+        sampler = g.pop("profile_sampler", None)
+        cprofile = g.pop("profile_cprofile", None)
+        if cprofile:
+            cprofile.disable()
+            self.cprofile_lock.release()
+            cprofile.create_stats()
+            data, mode = cprofile.stats, "cprofile"
+        elif sampler:
+            data, mode = sampler.stop(), "sample"
+        else:
+            return response
+        duration_ms = (time.perf_counter() - g.profile_start) * 1000
+        profile = Profile(
+            next(self.next_id), time.time(), request.method, request.full_path, request.endpoint,
+            g.profile_user_id, duration_ms, mode, data,
+        )
+        self.profiles.append(profile)
+        logger.info(f"Profiled {request.method} {request.path} ({mode}): {duration_ms:.1f} ms")
+        return response
+
+    def _stop_if_failed(self, exception):
+        """after_request isn't called when a view raises, so stop profiling here instead"""
+        sampler = g.pop("profile_sampler", None)
+        cprofile = g.pop("profile_cprofile", None)
+        if sampler:
+            sampler.stop()
+        if cprofile:
+            cprofile.disable()
+            self.cprofile_lock.release()
+
+    @staticmethod
+    def _current_user_id():
+        # Checking current_user loads the user from the db, so this is only done when there are users to match
+        return current_user.id if current_user.is_authenticated else None
+
+
+def to_pstats(profile: Profile) -> io.BytesIO:
+    """The profile in the format written by pstats.Stats.dump_stats()"""
+    return io.BytesIO(marshal.dumps(profile.data))
+
+
+def to_collapsed(profile: Profile) -> io.BytesIO:
+    """The profile as collapsed stacks, one "frame;frame;frame count" line per distinct stack"""
+    lines = (f"{stack} {count}" for stack, count in profile.data.most_common())
+    return io.BytesIO("\n".join(lines).encode())
@@ -0,0 +1,194 @@
+"""
+Append-only log of review events (a user viewed or skipped a card).
+
+Each event is a fixed size 13 byte record appended to a binary file, so recording a view costs one small local write
+instead of a PATCH to the card's row in Airtable. Every so often the log is compacted: its events are folded into
+per-user, per-card counters (kept in a small json file) and the log is truncated. Views that haven't been added to
+the num_views field in the db yet are kept as "unpushed" totals per card, so they can be sent to Airtable in a few
+batch updates. See compact_review_log() in main.py.
+
+Several worker processes may share the files, so appends and compactions take a file lock where the OS supports it.
+Pushing to Airtable happens outside the lock (it's slow), so a process first moves the views it's about to push
+into an "in flight" record, and other processes leave those alone.
+"""
+
+import json
+import os
+import struct
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows. Fine for a single process, e.g. the Flask dev server
+    fcntl = None
+
+VIEW = 0
+SKIP = 1
+record_format = struct.Struct("<IIIB")  # user_id, card_id, unix timestamp, action
+
+
+class ReviewLog:
+    def __init__(self, log_path: str, counts_path: str):
+        self.log_path = log_path
+        self.counts_path = counts_path
+        self.lock = threading.Lock()
+        self.counts = {}  # (user_id, card_id) -> [views, skips]
+        self.unpushed_views = Counter()  # card_id -> views not yet added to num_views in the db
+        self.in_flight = Counter()  # card_id -> views a process has taken to add to num_views, see take_unpushed()
+        self.in_flight_since = None
+        self.folded_bytes = 0  # length of the start of the log already folded into counts (after an interrupted compaction)
+        self.last_compaction = time.time()
+        self._load_counts()
+
+    def record(self, user_id: int, card_id: int, action: int):
+        event = record_format.pack(int(user_id), int(card_id), int(time.time()), action)
+        with self._locked_log("ab") as log_file:
+            log_file.write(event)  # unbuffered, so this is a single append
+
+    def num_events(self) -> int:
+        """Number of events waiting to be compacted"""
+        try:
+            return (os.path.getsize(self.log_path) - self.folded_bytes) // record_format.size
+        except FileNotFoundError:
+            return 0
+
+    def due_for_compaction(self, max_events: int, max_age_seconds: int) -> bool:
+        num_events = self.num_events()
+        return num_events >= max_events or (num_events > 0 and time.time() - self.last_compaction > max_age_seconds)
+
+    def compact(self):
+        """Folds all logged events into the counters, then truncates the log"""
+        with self._locked_log("a+b") as log_file:
+            num_events = self._fold(log_file)
+        logger.info(f"Compacted {num_events} review events")
+
+    def take_unpushed(self, push_timeout: float) -> Counter:
+        """
+        Compacts the log, then claims the unpushed views for this process to add to num_views in the db. Returns
+        them, or an empty Counter if another process's push is still in flight. Follow with mark_pushed() or
+        push_failed().
+
+        Claiming happens under the file lock, so two processes never push the same views. A push not finished after
+        push_timeout seconds is assumed to have died with its process, and its views go back to unpushed.
+        """
+        with self._locked_log("a+b") as log_file:
+            self._fold(log_file)
+            if self.in_flight:
+                if time.time() - self.in_flight_since < push_timeout:
+                    return Counter()
+                logger.warning(f"Push of {sum(self.in_flight.values())} views timed out. Pushing them again")
+                self.unpushed_views.update(self.in_flight)
+            self.in_flight, self.unpushed_views = self.unpushed_views, Counter()
+            self.in_flight_since = time.time()
+            self._save_counts()
+            return Counter(self.in_flight)
+
+    def forget_views(self, card_ids: list):
+        """Drops the views of these cards that aren't in num_views in the db yet, e.g. after num_views was reset"""
+        with self._locked_log("a+b") as log_file:
+            self._fold(log_file)
+            for card_id in card_ids:
+                self.unpushed_views.pop(card_id, None)
+                self.in_flight.pop(card_id, None)
+            self._save_counts()
+
+    def pending_views(self) -> Counter:
+        """Views per card not yet added to num_views in the db: those compacted but not pushed, plus those still in
+        the log (from every process). Reads the log, so call it once per batch of cards, not once per card."""
+        with self._locked_log("a+b") as log_file:
+            self._load_counts()
+            pending = self.unpushed_views + self.in_flight
+            log_file.seek(self.folded_bytes)
+            data = log_file.read()
+        data = data[: len(data) - len(data) % record_format.size]
+        for user_id, card_id, timestamp, action in record_format.iter_unpack(data):
+            if action == VIEW:
+                pending[card_id] += 1
+        return pending
+
+    def mark_pushed(self, pushed_views: Counter):
+        """Call once the num_views of these cards in the db include pushed_views (from take_unpushed())"""
+        with self._locked_log("ab"):
+            self._load_counts()
+            self.in_flight.subtract(pushed_views)
+            self.in_flight = +self.in_flight  # drops cards that are down to zero
+            self._save_counts()
+
+    def push_failed(self, views: Counter):
+        """Puts views from take_unpushed() back, to be pushed next time"""
+        with self._locked_log("ab"):
+            self._load_counts()
+            self.in_flight.subtract(views)
+            self.in_flight = +self.in_flight
+            self.unpushed_views.update(views)
+            self._save_counts()
+
+    def user_counts(self, user_id: int) -> dict:
+        """Returns {card_id: (views, skips)} for one user. Only includes compacted events."""
+        return {
+            card_id: tuple(counts)
+            for (counts_user_id, card_id), counts in self.counts.items()
+            if counts_user_id == user_id
+        }
+
+    def _fold(self, log_file) -> int:
+        """Folds the events in the (locked) log into the counters and truncates it. Returns the number of events"""
+        self._load_counts()  # another process may have compacted since we last looked
+        log_file.seek(self.folded_bytes)
+        data = log_file.read()
+        data = data[: len(data) - len(data) % record_format.size]  # ignore a half written last record
+        for user_id, card_id, timestamp, action in record_format.iter_unpack(data):
+            user_card_counts = self.counts.setdefault((user_id, card_id), [0, 0])
+            user_card_counts[action] += 1
+            if action == VIEW:
+                self.unpushed_views[card_id] += 1
+        # Save the counters before truncating. If we crash in between, folded_bytes stops the events being
+        # counted twice next time.
+        self.folded_bytes += len(data)
+        self._save_counts()
+        log_file.truncate(0)
+        self.folded_bytes = 0
+        self._save_counts()
+        self.last_compaction = time.time()
+        return len(data) // record_format.size
+
+    def _load_counts(self):
+        """Reloads the counters, which another process may have saved since we last did. Always, rather than when the
+        file's mtime changes: two saves within one filesystem clock tick can have the same mtime"""
+        try:
+            with open(self.counts_path) as counts_file:
+                saved = json.load(counts_file)
+        except FileNotFoundError:
+            return
+        self.folded_bytes = saved["folded_bytes"]
+        self.counts = {
+            tuple(int(n) for n in key.split(":")): counts for key, counts in saved["counts"].items()
+        }
+        self.unpushed_views = Counter({int(card_id): n for card_id, n in saved["unpushed_views"].items()})
+        self.in_flight = Counter({int(card_id): n for card_id, n in saved.get("in_flight", {}).items()})
+        self.in_flight_since = saved.get("in_flight_since")
+
+    def _save_counts(self):
+        saved = {
+            "folded_bytes": self.folded_bytes,
+            "counts": {f"{user_id}:{card_id}": counts for (user_id, card_id), counts in self.counts.items()},
+            "unpushed_views": self.unpushed_views,
+            "in_flight": self.in_flight,
+            "in_flight_since": self.in_flight_since,
+        }
+        temp_path = self.counts_path + ".tmp"
+        with open(temp_path, "w") as counts_file:
+            json.dump(saved, counts_file)
+        os.replace(temp_path, self.counts_path)  # atomic, so a crash never leaves half a counts file
+
+    @contextmanager
+    def _locked_log(self, mode: str):
+        """Opens the log file, locked against other threads and (where supported) other processes"""
+        with self.lock, open(self.log_path, mode, buffering=0) as log_file:
+            if fcntl:
+                fcntl.flock(log_file.fileno(), fcntl.LOCK_EX)  # released when the file is closed
+            yield log_file
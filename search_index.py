@@ -0,0 +1,128 @@
+"""
+Local full-text search over card titles, bodies and tags.
+
+An in-memory inverted index (term -> {card_id: weighted term frequency}) ranked with BM25, so queries are answered
+without a round trip to Airtable. The index is built once from card data already retrieved from the db and then kept
+up to date as cards are created, edited and archived.
+"""
+
+import html
+import math
+import re
+import threading
+from collections import Counter, defaultdict, namedtuple
+from loguru import logger
+
+Search_result = namedtuple("Search_result", ["card_id", "title", "tags", "score"])
+
+# Words in the title count for more than words in the body when ranking
+FIELD_WEIGHTS = {"title": 3, "tags": 2, "body": 1}
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+html_tag_pattern = re.compile(r"<[^>]+>")
+word_pattern = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list:
+    """Lowercases text, strips html tags and entities (CKEditor stores the body as html) and splits it into words"""
+    if not text:
+        return []
+    return word_pattern.findall(html.unescape(html_tag_pattern.sub(" ", text)).lower())
+    # ^ unescaped after stripping tags, so an escaped "&lt;b&gt;" stays as text
+
+
+class SearchIndex:
+    """Inverted index of cards. Cards are identified by card_id, not the Airtable rec_id"""
+
+    def __init__(self):
+        self.postings = defaultdict(dict)  # term -> {card_id: weighted term frequency}
+        self.doc_terms = {}  # card_id -> Counter of weighted terms, so a card can be removed or re-indexed
+        self.doc_lengths = {}  # card_id -> sum of weighted term frequencies
+        self.total_length = 0
+        self.titles = {}
+        self.tags = {}
+        self.is_built = False
+        self.lock = threading.Lock()
+
+    def build(self, cards: list):
+        """(Re)builds the whole index from a list of card dicts (as returned by add_missing())"""
+        with self.lock:
+            self.postings.clear()
+            self.doc_terms.clear()
+            self.doc_lengths.clear()
+            self.titles.clear()
+            self.tags.clear()
+            self.total_length = 0
+            for card in cards:
+                if not card["archived"]:
+                    self._add(card)
+            self.is_built = True
+        logger.info(f"Search index built: {len(self.doc_terms)} cards, {len(self.postings)} terms")
+
+    def update_card(self, card: dict):
+        """Adds a new card or re-indexes an edited one. Archived cards are removed from the index"""
+        with self.lock:
+            self._remove(card["card_id"])
+            if not card.get("archived"):
+                self._add(card)
+
+    def remove_card(self, card_id: int):
+        with self.lock:
+            self._remove(card_id)
+
+    def search(self, query: str, limit: int = 20) -> list:
+        """Returns up to limit Search_results, best match first. Every query word must appear in a card"""
+        query_terms = set(tokenize(query))
+        if not query_terms:
+            return []
+        with self.lock:
+            if any(term not in self.postings for term in query_terms):
+                return []
+            # Start from the rarest term so the candidate set is as small as possible
+            terms_by_rarity = sorted(query_terms, key=lambda term: len(self.postings[term]))
+            candidates = set(self.postings[terms_by_rarity[0]])
+            for term in terms_by_rarity[1:]:
+                candidates.intersection_update(self.postings[term])
+            num_docs = len(self.doc_terms)
+            avg_length = self.total_length / num_docs if num_docs else 0
+            scores = Counter()
+            for term in query_terms:
+                postings = self.postings[term]
+                idf = math.log(1 + (num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for card_id in candidates:
+                    tf = postings[card_id]
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[card_id] / avg_length)
+                    scores[card_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+            return [
+                Search_result(card_id, self.titles[card_id], self.tags[card_id], score)
+                for card_id, score in scores.most_common(limit)
+            ]
+
+    def _add(self, card: dict):
+        card_id = card["card_id"]
+        terms = Counter()
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(card.get(field)):
+                terms[term] += weight
+        for term, frequency in terms.items():
+            self.postings[term][card_id] = frequency
+        self.doc_terms[card_id] = terms
+        length = sum(terms.values())
+        self.doc_lengths[card_id] = length
+        self.total_length += length
+        self.titles[card_id] = card.get("title")
+        self.tags[card_id] = card.get("tags")
+
+    def _remove(self, card_id: int):
+        terms = self.doc_terms.pop(card_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self.postings[term]
+            postings.pop(card_id, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(card_id)
+        self.titles.pop(card_id, None)
+        self.tags.pop(card_id, None)
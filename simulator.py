@@ -0,0 +1,220 @@
+"""
+Offline simulator of the card scheduling policy, for tuning the defaults in global_constants.py.
+
+Replays what Schedule does over months of simulated study, for many independent runs at once:
+ * every card's weight is get_weight(initial_frequency, num_views, frequency_decay), with views capped at
+   MAX_INFREQUENCY
+ * the queue is filled with QUEUE_SIZE cards picked at random by weight without replacement, from the cards that
+   weren't in the previous queue and aren't skipped
+ * each card is viewed once as the queue is served, and the new view counts are used to fill the next queue. The app
+   writes views to the db in batches (see review_log.py), but fill_queue() adds the views still in the review log, so
+   there's no lag to model
+
+All runs advance together as NumPy arrays of shape (runs, cards). Weighted sampling without replacement uses
+exponential keys (Efraimidis-Spirakis): each card draws E / weight with E ~ Exp(1), and the QUEUE_SIZE smallest keys
+are the cards picked, in order. That gives exactly the distribution of picking one card at a time with
+random.choices() and removing it, as Schedule.fill_queue() does, but for every run in one vectorized step.
+
+Reports how long cards go between views (their exposure intervals), by how many times they had been seen, and per card
+with --csv. For example, to see what a slower decay would do to a 2000 card deck studied 60 cards a day:
+
+    python simulator.py --cards 2000 --cards-per-day 60 --days 90 --decay 3
+"""
+
+import argparse
+import csv
+import time
+import numpy as np
+import global_constants as gc
+
+
+def weights(initial_frequency, num_views, frequency_decay, max_infrequency: int):
+    """get_weight() from main.py, for arrays"""
+    views = np.minimum(num_views, max_infrequency)
+    return initial_frequency * np.exp(-views / (gc.FREQUENCY_DECAY_RATE_MAX - frequency_decay + 1))
+
+
+def simulate(initial_frequency, frequency_decay, options, rng) -> dict:
+    """
+    Runs the schedule for options.runs runs of options.days days. initial_frequency and frequency_decay are arrays with
+    one value per card.
+
+    Returns the views per card per run, and every exposure interval seen: the card, the number of views the card had
+    before, and the number of cards served since it was last seen.
+    """
+    runs, num_cards, queue_size = options.runs, len(initial_frequency), options.queue_size
+    if num_cards <= queue_size:
+        raise ValueError(f"Need more than QUEUE_SIZE ({queue_size}) cards")
+    num_batches = int(options.days * options.cards_per_day) // queue_size
+    if not num_batches:
+        raise ValueError(f"Need at least QUEUE_SIZE ({queue_size}) cards viewed in total")
+    run_rows = np.arange(runs)[:, None]  # for indexing one card per run: array[run_rows, cards]
+
+    num_views = np.zeros((runs, num_cards), dtype=np.int32)
+    last_seen = np.full((runs, num_cards), -1, dtype=np.int64)  # slot each card was last served in, -1 for never
+    skipped_until = np.zeros((runs, num_cards), dtype=np.int32)  # first day the card can be picked again
+    card_weights = np.broadcast_to(
+        weights(initial_frequency, 0, frequency_decay, options.max_infrequency), (runs, num_cards)
+    ).astype(np.float32)
+    previous_queue = None
+    intervals = []  # (card, views before, slots since last view) arrays, one set per batch
+
+    for batch in range(num_batches):
+        first_slot = batch * queue_size
+        day = first_slot // options.cards_per_day
+        # Fill the queue: the queue_size smallest E / weight keys, in order
+        keys = rng.standard_exponential((runs, num_cards), dtype=np.float32)  # float32 halves the memory traffic
+        with np.errstate(divide="ignore"):
+            keys /= card_weights
+        keys[skipped_until > day] = np.inf
+        if previous_queue is not None:
+            keys[run_rows, previous_queue] = np.inf
+        queue = np.argpartition(keys, queue_size - 1, axis=1)[:, :queue_size]
+        queue_keys = np.take_along_axis(keys, queue, axis=1)
+        order = np.argsort(queue_keys, axis=1)
+        queue = np.take_along_axis(queue, order, axis=1)
+        served = np.isfinite(np.take_along_axis(queue_keys, order, axis=1))
+        # ^ not served if there weren't enough eligible cards (Schedule leaves the queue short)
+
+        # Serve the queue
+        slots = first_slot + np.arange(queue_size)[None, :].repeat(runs, axis=0)
+        seen_before = served & (last_seen[run_rows, queue] >= 0)
+        intervals.append(
+            (
+                queue[seen_before],
+                num_views[run_rows, queue][seen_before],
+                (slots - last_seen[run_rows, queue])[seen_before],
+            )
+        )
+        last_seen[run_rows, queue] = np.where(served, slots, last_seen[run_rows, queue])
+        num_views[run_rows, queue] += served
+        if options.skip_chance:
+            skips = served & (rng.random((runs, queue_size)) < options.skip_chance)
+            skipped_until[run_rows, queue] = np.where(skips, day + options.skip_days, skipped_until[run_rows, queue])
+        card_weights[run_rows, queue] = weights(
+            initial_frequency[queue], num_views[run_rows, queue], frequency_decay[queue], options.max_infrequency
+        )
+        previous_queue = queue
+
+    cards, views_before, gaps = (np.concatenate(column) for column in zip(*intervals))
+    return {"num_views": num_views, "cards": cards, "views_before": views_before, "gaps": gaps}
+
+
+def interval_report(views_before, gaps_in_days, max_infrequency: int) -> list:
+    """Rows of (views, intervals, mean, p50, p90) for intervals after a card's 1st, 2nd... view. Intervals that hadn't
+    ended when the simulation did aren't included, which makes later intervals look shorter than they are unless
+    --days is well above the p90s."""
+    rows = []
+    for views in range(1, max_infrequency + 1):
+        if views < max_infrequency:
+            selected = gaps_in_days[views_before == views]
+        else:
+            selected = gaps_in_days[views_before >= views]
+        if len(selected):
+            p50, p90 = np.percentile(selected, [50, 90])
+            rows.append((views, len(selected), selected.mean(), p50, p90))
+    return rows
+
+
+def per_card_report(results: dict, initial_frequency, frequency_decay, options) -> list:
+    """Rows of (card, initial_frequency, decay, mean views, never seen %, mean, p50, p90 and max interval in days)"""
+    num_cards = len(initial_frequency)
+    gaps_in_days = results["gaps"] / options.cards_per_day
+    by_card = np.argsort(results["cards"], kind="stable")
+    card_starts = np.searchsorted(results["cards"][by_card], np.arange(num_cards + 1))
+    sorted_gaps = gaps_in_days[by_card]
+    rows = []
+    for card in range(num_cards):
+        card_gaps = sorted_gaps[card_starts[card]: card_starts[card + 1]]
+        views = results["num_views"][:, card]
+        summary = [np.nan] * 4
+        if len(card_gaps):
+            summary = [card_gaps.mean(), *np.percentile(card_gaps, [50, 90]), card_gaps.max()]
+        rows.append(
+            (card, initial_frequency[card], frequency_decay[card], views.mean(), 100 * (views == 0).mean(), *summary)
+        )
+    return rows
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Simulate the card schedule to tune its parameters")
+    parser.add_argument("--cards", type=int, default=1000, help="cards in the deck")
+    parser.add_argument("--days", type=float, default=90, help="days of study to simulate")
+    parser.add_argument("--cards-per-day", type=int, default=50, help="cards viewed per day")
+    parser.add_argument("--runs", type=int, default=100, help="independent runs to average over")
+    parser.add_argument("--initial-frequency", type=int, default=gc.INITIAL_FREQUENCY_DEFAULT)
+    parser.add_argument("--decay", type=int, default=gc.FREQUENCY_DECAY_DEFAULT, help="frequency_decay, 1-10")
+    parser.add_argument("--max-infrequency", type=int, default=gc.MAX_INFREQUENCY)
+    parser.add_argument("--queue-size", type=int, default=gc.QUEUE_SIZE)
+    parser.add_argument(
+        "--mixed", action="store_true",
+        help="give cards random initial frequencies and decay rates instead, to compare them in the --csv report",
+    )
+    parser.add_argument("--skip-chance", type=float, default=0, help="chance a viewed card is skipped")
+    parser.add_argument("--skip-days", type=int, default=1, help="days a skipped card is skipped for")
+    parser.add_argument("--csv", help="write per-card exposure intervals to this file")
+    parser.add_argument("--seed", type=int)
+    options = parser.parse_args(args)
+    if not 1 <= options.decay <= gc.FREQUENCY_DECAY_RATE_MAX:
+        parser.error(f"--decay must be 1-{gc.FREQUENCY_DECAY_RATE_MAX}")
+    if not 1 <= options.initial_frequency <= gc.INITIAL_FREQUENCY_MAX:
+        parser.error(f"--initial-frequency must be 1-{gc.INITIAL_FREQUENCY_MAX}")
+    for name in ("cards", "days", "cards_per_day", "runs", "max_infrequency", "queue_size", "skip_days"):
+        if getattr(options, name) <= 0:
+            parser.error(f"--{name.replace('_', '-')} must be more than 0")
+    if not 0 <= options.skip_chance <= 1:
+        parser.error("--skip-chance must be 0-1")
+    if options.cards <= options.queue_size:
+        parser.error(f"--cards must be more than --queue-size ({options.queue_size})")
+    if options.days * options.cards_per_day < options.queue_size:
+        parser.error(f"--days times --cards-per-day must be at least --queue-size ({options.queue_size})")
+    return options
+
+
+def main(args=None):
+    options = parse_args(args)
+    rng = np.random.default_rng(options.seed)
+    if options.mixed:
+        initial_frequency = rng.integers(1, gc.INITIAL_FREQUENCY_MAX + 1, options.cards)
+        frequency_decay = rng.integers(1, gc.FREQUENCY_DECAY_RATE_MAX + 1, options.cards)
+    else:
+        initial_frequency = np.full(options.cards, options.initial_frequency)
+        frequency_decay = np.full(options.cards, options.decay)
+
+    start = time.perf_counter()
+    results = simulate(initial_frequency, frequency_decay, options, rng)
+    elapsed = time.perf_counter() - start
+
+    num_views = results["num_views"]
+    gaps_in_days = results["gaps"] / options.cards_per_day
+    print(
+        f"{options.runs} runs of {options.days:.0f} days, {options.cards} cards, {options.cards_per_day} cards/day, "
+        f"queue of {options.queue_size}, max infrequency {options.max_infrequency}"
+        + ("" if options.mixed else f", initial frequency {options.initial_frequency}, decay {options.decay}")
+        + f" ({elapsed:.1f} s)"
+    )
+    print(
+        f"Views per card: mean {num_views.mean():.1f}, "
+        f"p10 {np.percentile(num_views, 10):.0f}, p90 {np.percentile(num_views, 90):.0f}. "
+        f"Never seen: {100 * (num_views == 0).mean():.1f}% of cards"
+    )
+    print("\nDays between views, by views so far (not counting intervals still open at the end)")
+    print(f"{'views':>6}{'intervals':>11}{'mean':>8}{'p50':>8}{'p90':>8}")
+    for views, count, mean, p50, p90 in interval_report(results["views_before"], gaps_in_days, options.max_infrequency):
+        label = f"{views}+" if views == options.max_infrequency else str(views)
+        print(f"{label:>6}{count:>11}{mean:>8.1f}{p50:>8.1f}{p90:>8.1f}")
+
+    if options.csv:
+        with open(options.csv, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(
+                ["card", "initial_frequency", "frequency_decay", "mean_views", "never_seen_percent",
+                 "mean_interval_days", "p50_interval_days", "p90_interval_days", "max_interval_days"]
+            )
+            for row in per_card_report(results, initial_frequency, frequency_decay, options):
+                writer.writerow([round(value, 3) if isinstance(value, float) else value for value in row])
+        print(f"\nPer-card intervals written to {options.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Airtable tables, connected on first use and guarded by a circuit breaker.
+
+card_table and user_table can be imported and passed around like pyairtable Tables, but nothing is set up until a
+method is called on one of them. Importing the app therefore costs no network or session setup, though pyairtable's
+modules are still imported (by main.py's formula helpers) and so is requests. Under a preforking server (gunicorn with
+preload_app) each worker opens its own connections after the fork instead of sharing sockets with the master.
+
+Reads and writes go through a circuit breaker (see circuit_breaker.py), so when Airtable is down requests don't each
+wait for a timeout:
+ * every successful read is kept in a small cache, and when the db can't be reached the last result of the same
+   read is served instead (stale, with a flash message saying so)
+ * writes are queued and replayed, in order, once the db can be reached again. A failed write opens the breaker, so
+   there's always a probe to replay what it queued. The breaker only closes once the queue is empty, and while
+   anything is queued new writes join the end of the queue, so a replayed write never lands on top of a newer one.
+   The queue is kept in memory, so writes still queued when the app restarts are lost.
+If a read has never succeeded before, DatabaseUnavailable (a requests ConnectionError) is raised as before.
+"""
+
+import os
+import threading
+from collections import OrderedDict, deque
+from functools import partial
+from flask import flash, g, has_request_context
+from requests.exceptions import ConnectionError, HTTPError, Timeout
+from loguru import logger
+import global_constants as gc
+from circuit_breaker import CircuitBreaker
+
+airtable_cards_table_name = "cards_table"
+airtable_user_table_name = "users_table"
+
+read_methods = {"all", "first", "get"}
+write_methods = {"create", "update", "batch_create", "batch_update"}
+
+tables_lock = threading.Lock()
+
+
+class DatabaseUnavailable(ConnectionError):
+    """Raised instead of waiting for a timeout when the db is known to be down and there's no saved result"""
+
+
+class LazyTable:
+    """Stands in for a pyairtable Table, creating the real one the first time it is used"""
+
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+        self._table = None
+
+    def __getattr__(self, name):
+        # Only called for attributes LazyTable doesn't have itself, i.e. everything a pyairtable Table has
+        attribute = getattr(self.get_table(), name)
+        if name in read_methods:
+            return partial(self._read, name, attribute)
+        if name in write_methods:
+            return partial(self._write, name, attribute)
+        return attribute
+
+    def __setattr__(self, name, value):
+        if name in ("table_name", "_table"):
+            super().__setattr__(name, value)
+        else:
+            setattr(self.get_table(), name, value)
+
+    def get_table(self):
+        if self._table is None:
+            connect()
+        return self._table
+
+    def _read(self, name, method, *args, **kwargs):
+        key = (self.table_name, name, repr(args), repr(sorted(kwargs.items())))
+        if not breaker.is_open:
+            try:
+                result = method(*args, **kwargs)
+            except (ConnectionError, Timeout, HTTPError) as e:
+                if not is_outage(e):
+                    raise
+                breaker.record_failure()
+                logger.error(f"Unable to read {self.table_name} from database: {e!r}")
+            else:
+                breaker.record_success()
+                stale_cache.put(key, result)
+                return result
+        found, result = stale_cache.get(key)
+        if not found:
+            raise DatabaseUnavailable(f"Database unavailable and no saved copy of {self.table_name}.{name}{args}")
+        notify("Unable to reach database. Showing saved data, which may be out of date.")
+        return result
+
+    def _write(self, name, method, *args, **kwargs):
+        """Returns the response, or None if the write was queued to be replayed later"""
+        with pending_writes_lock:
+            queued = breaker.is_open or bool(pending_writes)
+            if queued:
+                pending_writes.append((self, name, args, kwargs))
+        if not queued:
+            try:
+                result = method(*args, **kwargs)
+            except (ConnectionError, Timeout, HTTPError) as e:
+                if not is_outage(e):
+                    raise
+                breaker.record_failure()
+                logger.error(f"Unable to write {self.table_name}.{name} to database: {e!r}")
+                # ^ if the connection dropped after Airtable got the request, replaying it may apply it twice
+                with pending_writes_lock:
+                    pending_writes.append((self, name, args, kwargs))
+                    breaker.open(f"{self.table_name}.{name} queued")
+                    # ^ even if too few calls have failed to open it, so the probe replays the queue. Under the lock,
+                    # so writes are only queued behind this one while the breaker is open and a replay is coming
+            else:
+                breaker.record_success()
+                return result
+        logger.warning(f"Queued {self.table_name}.{name} for when the database is back. {len(pending_writes)} queued")
+        notify("Unable to reach database. Your changes are saved and will be sent when it's back.")
+        return None
+
+
+class StaleCache:
+    """The last result of each distinct read, least recently used dropped first"""
+
+    def __init__(self, max_entries: int):
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+    def put(self, key, result):
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get(self, key) -> tuple:
+        """Returns (found, result)"""
+        with self.lock:
+            if key not in self.entries:
+                return False, None
+            self.entries.move_to_end(key)
+            return True, self.entries[key]
+
+
+def is_outage(error) -> bool:
+    """True for errors that mean Airtable is unreachable or overloaded, not that our request was wrong"""
+    if isinstance(error, HTTPError):
+        return error.response is not None and (error.response.status_code >= 500 or error.response.status_code == 429)
+    return True
+
+
+def notify(message: str):
+    """Flashes a message to the user, at most once per request"""
+    if not has_request_context():
+        return
+    if "storage_messages" not in g:
+        g.storage_messages = set()
+    if message not in g.storage_messages:
+        flash(message)
+        g.storage_messages.add(message)
+
+
+def probe():
+    card_table.get_table().first(fields=["card_id"])
+
+
+def replay_writes():
+    """Sends the writes queued while the db was down, oldest first, then closes the breaker. Raises if the db goes
+    down again, which keeps the breaker open"""
+    logger.info(f"Replaying {len(pending_writes)} queued writes")
+    while True:
+        with pending_writes_lock:
+            if not pending_writes:
+                breaker.close()  # while holding the lock, so no write can be queued after the last one is replayed
+                return
+            lazy_table, name, args, kwargs = pending_writes[0]
+        try:
+            getattr(lazy_table.get_table(), name)(*args, **kwargs)
+        except (ConnectionError, Timeout, HTTPError) as e:
+            if is_outage(e):
+                logger.error(f"Database unreachable while replaying writes: {e!r}")
+                raise
+            logger.error(f"Dropped queued write {lazy_table.table_name}.{name}{args}: {e!r}")
+        with pending_writes_lock:
+            pending_writes.popleft()
+
+
+card_table = LazyTable(airtable_cards_table_name)
+user_table = LazyTable(airtable_user_table_name)
+stale_cache = StaleCache(gc.STALE_CACHE_MAX_ENTRIES)
+pending_writes = deque()  # (LazyTable, method name, args, kwargs)
+pending_writes_lock = threading.Lock()
+breaker = CircuitBreaker(
+    "airtable",
+    failure_rate=gc.STORAGE_BREAKER_FAILURE_RATE,
+    window_size=gc.STORAGE_BREAKER_WINDOW,
+    min_calls=gc.STORAGE_BREAKER_MIN_CALLS,
+    probe_interval=gc.STORAGE_BREAKER_PROBE_SECONDS,
+    probe=probe,
+    recover=replay_writes,
+)
+
+
+def connect():
+    """Creates the pyairtable Tables behind card_table and user_table, sharing one pooled Session"""
+    from pyairtable import Table
+    from io_pool import share_session
+
+    with tables_lock:
+        if card_table._table is not None:
+            return
+        airtable_api_key = os.environ.get("AIRTABLE_API_KEY")
+        airtable_base_id = os.environ.get("AIRTABLE_BASE_ID")
+        airtable_api_url = os.environ.get("AIRTABLE_API_URL")  # e.g. a local stand-in for load testing, see loadtest/
+        tables = [
+            Table(airtable_api_key, airtable_base_id, lazy_table.table_name, timeout=gc.AIRTABLE_TIMEOUT)
+            for lazy_table in (card_table, user_table)
+        ]
+        share_session(*tables)
+        if airtable_api_url:
+            for table in tables:
+                table.API_URL = airtable_api_url
+        user_table._table = tables[1]
+        card_table._table = tables[0]  # set last: other threads skip the lock once this is set
+        logger.info("Connected to Airtable")
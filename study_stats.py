@@ -0,0 +1,165 @@
+"""
+Running totals for the /stats page.
+
+Counting cards per tag, views, due cards etc. from card_table.all() would mean reading the whole deck on every visit.
+Instead StudyStats loads the deck once, keeps the last known state of each card, and adjusts a few Counters whenever a
+card is created, edited, archived, viewed or skipped: take the card's old state out of the totals, put the new state
+in. Each update costs O(1) and reading the totals costs O(number of tags + distinct skip dates), whatever the size of
+the deck.
+
+Each server process keeps its own totals (like its own Schedule), so changes made through another process show up
+after the next rebuild, every STATS_REBUILD_SECONDS.
+"""
+
+import datetime as dt
+import math
+import threading
+import time
+from collections import Counter, namedtuple
+from loguru import logger
+import global_constants as gc
+
+Card_stats = namedtuple(
+    "Card_stats", ["tags", "num_views", "initial_frequency", "frequency_decay", "skip_until", "archived"]
+)
+Stats_summary = namedtuple(
+    "Stats_summary",
+    [
+        "active_total",
+        "archived_total",
+        "due_total",
+        "skipped_total",
+        "tag_counts",  # [(tag, number of cards)], most cards first
+        "views_histogram",  # [(num_views, number of cards)], the last bucket is MAX_INFREQUENCY or more
+        "weight_histogram",  # [(lowest weight in bucket, number of cards)]
+        "coming_due",  # [(date, number of cards skipped until then)], soonest first
+        "built_at",
+    ],
+)
+
+UNTAGGED = "(no tags)"
+num_weight_buckets = math.ceil(gc.INITIAL_FREQUENCY_MAX / gc.STATS_WEIGHT_BUCKET)
+
+
+class StudyStats:
+    def __init__(self, get_weight):
+        self.get_weight = get_weight  # main.get_weight, passed in to avoid a circular import
+        self.cards = {}  # card_id -> Card_stats, the state each card was last counted in
+        self.tag_counts = Counter()
+        self.views_histogram = Counter()
+        self.weight_histogram = Counter()
+        self.skip_until_counts = Counter()  # "YYYY-MM-DD" -> number of cards. Dates up to today are due
+        self.archived_total = 0
+        self.built_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_built(self) -> bool:
+        return self.built_at is not None
+
+    def is_stale(self, max_age: float) -> bool:
+        return not self.is_built or time.time() - self.built_at > max_age
+
+    def build(self, cards: list):
+        """(Re)counts everything from a list of card dicts (as returned by add_missing(), with num_views including
+        views not yet written to the db)"""
+        with self.lock:
+            self.cards.clear()
+            self.tag_counts.clear()
+            self.views_histogram.clear()
+            self.weight_histogram.clear()
+            self.skip_until_counts.clear()
+            self.archived_total = 0
+            for card in cards:
+                self._set(card["card_id"], card_stats(card))
+            self.built_at = time.time()
+        logger.info(f"Study stats built: {len(self.cards)} cards, {self.archived_total} archived")
+
+    def update_card(self, card: dict):
+        """Counts a new or edited card (a dict as for build())"""
+        with self.lock:
+            self._set(card["card_id"], card_stats(card))
+
+    def archive_card(self, card_id: int):
+        with self.lock:
+            if card_id in self.cards:
+                self._set(card_id, self.cards[card_id]._replace(archived=True))
+
+    def record_view(self, card_id: int):
+        with self.lock:
+            if card_id in self.cards:
+                state = self.cards[card_id]
+                self._set(card_id, state._replace(num_views=state.num_views + 1))
+
+    def record_skip(self, card_id: int, skip_until: str):
+        with self.lock:
+            if card_id in self.cards:
+                self._set(card_id, self.cards[card_id]._replace(skip_until=skip_until))
+
+    def summary(self) -> Stats_summary:
+        today = str(dt.date.today())
+        with self.lock:
+            skipped = sorted((date, count) for date, count in self.skip_until_counts.items() if date > today)
+            skipped_total = sum(count for date, count in skipped)
+            active_total = len(self.cards) - self.archived_total
+            return Stats_summary(
+                active_total=active_total,
+                archived_total=self.archived_total,
+                due_total=active_total - skipped_total,
+                skipped_total=skipped_total,
+                tag_counts=self.tag_counts.most_common(),
+                views_histogram=[(views, self.views_histogram[views]) for views in range(gc.MAX_INFREQUENCY + 1)],
+                weight_histogram=[
+                    (bucket * gc.STATS_WEIGHT_BUCKET, self.weight_histogram[bucket])
+                    for bucket in range(num_weight_buckets)
+                ],
+                coming_due=skipped[:gc.STATS_COMING_DUE_DATES],
+                built_at=self.built_at,
+            )
+
+    def _set(self, card_id: int, new_state: Card_stats):
+        old_state = self.cards.get(card_id)
+        if old_state == new_state:
+            return
+        if old_state:
+            self._count(old_state, -1)
+        self._count(new_state, 1)
+        self.cards[card_id] = new_state
+
+    def _count(self, state: Card_stats, sign: int):
+        """Adds a card's state to the totals (sign 1) or takes it out (sign -1)"""
+        if state.archived:
+            self.archived_total += sign
+            return
+        # ^ archived cards only count towards archived_total
+        for tag in state.tags or (UNTAGGED,):
+            add(self.tag_counts, tag, sign)
+        add(self.views_histogram, min(state.num_views, gc.MAX_INFREQUENCY), sign)
+        weight = self.get_weight(state.initial_frequency, state.num_views, state.frequency_decay)
+        add(self.weight_histogram, weight_bucket(weight), sign)
+        add(self.skip_until_counts, state.skip_until, sign)
+
+
+def add(counter: Counter, key, sign: int):
+    counter[key] += sign
+    if not counter[key]:
+        del counter[key]  # so tags with no cards left aren't listed
+
+
+def weight_bucket(weight: float) -> int:
+    return min(int(weight // gc.STATS_WEIGHT_BUCKET), num_weight_buckets - 1)  # the top bucket includes the max
+
+
+def card_stats(card: dict) -> Card_stats:
+    skip_until = card.get("skip_until") or gc.SKIP_UNTIL_DATE_DEFAULT
+    if skip_until <= str(dt.date.today()):
+        skip_until = gc.SKIP_UNTIL_DATE_DEFAULT
+        # ^ all due, so there's no need for skip_until_counts to keep a key for every date cards were last skipped to
+    return Card_stats(
+        tags=tuple(card["tags"].split()) if card.get("tags") else (),
+        num_views=card.get("num_views") or 0,
+        initial_frequency=card.get("initial_frequency") or gc.INITIAL_FREQUENCY_DEFAULT,
+        frequency_decay=card.get("frequency_decay") or gc.FREQUENCY_DECAY_DEFAULT,
+        skip_until=skip_until,
+        archived=bool(card.get("archived")),
+    )
@@ -0,0 +1,9 @@
+"""
+Entry point for WSGI servers, e.g.
+    gunicorn wsgi:app
+or, on PythonAnywhere, import application from here in the WSGI configuration file.
+"""
+
+from main import create_app
+
+app = application = create_app()